@@ -0,0 +1,292 @@
+"""
+Benchmarks for the IoT Data Inspector
+-------------------------------------
+- parse: single-pass FIELD_LINE_RE parser vs. the original
+  per-line x per-pattern loop, on the SAMPLE chunk from test_project.py
+- suite: generate synthetic chunk archives (days, sites, gaps, noise,
+  file size) and time index_chunks, parse_chunk_text, query_day,
+  query_hours and inspection_report at each requested archive size;
+  throughput, p50/p99 latency and peak RSS go to a JSON file. Each size
+  is benchmarked in a fresh (spawned) process, so its peak RSS covers
+  only that size's benchmark, not generation or earlier sizes
+
+Usage:
+    python benchmark.py parse --chunks 1000000
+    python benchmark.py parse --chunks 1000000 --file files/chunk_2025-08-01_00.txt
+    python benchmark.py suite --files 1000 10000 100000 --sites 2 --gap-rate 0.01 --out bench.json
+"""
+
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import project
+from test_project import SAMPLE
+
+
+def parse_chunk_text_per_pattern(text: str) -> Dict[str, str]:
+    """
+    The original parser: every FIELD_PATTERNS regex against every stripped line.
+    Kept as the baseline for bench_parse.
+    """
+    out: Dict[str, str] = {}
+    for line in text.splitlines():
+        line = line.strip()
+        for key, pat in project.FIELD_PATTERNS.items():
+            m = pat.match(line)
+            if m and key not in out:
+                out[key] = m.group(1).strip()
+    out["raw"] = text.strip()
+    return out
+
+
+def _time_parser(fn: Callable[[str], Dict[str, str]], text: str, chunks: int) -> float:
+    start = time.perf_counter()
+    for _ in range(chunks):
+        fn(text)
+    return time.perf_counter() - start
+
+
+def bench_parse(chunks: int, text: str = SAMPLE) -> Dict[str, float]:
+    """
+    Parse `text` (default: SAMPLE) `chunks` times with both parsers and return timings.
+    """
+    assert project.parse_chunk_text(text) == parse_chunk_text_per_pattern(text)
+    old = _time_parser(parse_chunk_text_per_pattern, text, chunks)
+    new = _time_parser(project.parse_chunk_text, text, chunks)
+    return {
+        "chunks": chunks,
+        "per_pattern_s": old,
+        "single_pass_s": new,
+        "per_pattern_chunks_per_s": chunks / old,
+        "single_pass_chunks_per_s": chunks / new,
+        "speedup": old / new,
+    }
+
+
+# ---------- Synthetic archives ----------
+
+IEQ_LABELS = ("optimal", "acceptable", "poor")
+PM25_LABELS = ("good", "moderate")
+
+
+def synthetic_chunk(d: date, hour: int, rng: random.Random, noise: float = 1.0, size: int = 0) -> str:
+    """
+    One chunk in the layout of the real files, with values drifting by
+    `noise` around a daily cycle; padded with operator notes up to `size` bytes.
+    """
+    cycle = math.sin((hour - 9) / 24 * 2 * math.pi)
+    temp = 27.0 + 2.0 * cycle + rng.gauss(0, 0.3 * noise)
+    co2 = 420 + 40 * max(cycle, 0) + rng.gauss(0, 10 * noise)
+    pm25 = max(0.5, 4.0 + rng.gauss(0, 2 * noise))
+    ieq = int(min(100, max(0, 50 + rng.gauss(0, 15 * noise))))
+    lines = [
+        f"Data: {d.isoformat()}",
+        f"Hour range: {hour:02d}:00 - {(hour + 1) % 24:02d}:00",
+        "",
+        f"Temperature: median {temp:.1f}°C, max {temp + 0.1:.1f}°C, min {temp - 0.1:.1f}°C",
+        f"Humidity: median {45 + rng.gauss(0, 3 * noise):.1f}%",
+        f"IEQ median: {ieq} ({IEQ_LABELS[0 if ieq > 60 else 1 if ieq > 35 else 2]})",
+        f"CO₂: {co2 - 4:.0f}–{co2 + 4:.0f} ppm (optimal)",
+        f"PM2.5: {pm25:.1f} µg/m³ ({PM25_LABELS[0 if pm25 < 6 else 1]})",
+        f"illuminance: median {max(0, int(300 * cycle)) if 6 <= hour <= 20 else 0} lux",
+        "",
+        "Soil moisture (pot/plant): n.d.",
+        "",
+        "Door events:",
+        "- No relevant event",
+    ]
+    text = "\n".join(lines)
+    while len(text.encode("utf-8")) < size:
+        text += "\nNote: routine check, no anomaly reported."
+    return text
+
+
+def generate_archive(root: str, files: int, sites: int = 1, gap_rate: float = 0.0, noise: float = 1.0,
+                     file_size: int = 0, start: date = date(2020, 1, 1), seed: int = 0) -> Dict[str, int]:
+    """
+    Write about `files` hourly chunks, spread over `sites` folders
+    root/site_00, root/site_01, ...; each hour is skipped with probability
+    gap_rate. Returns site folder -> files written.
+    """
+    rng = random.Random(seed)
+    per_site = math.ceil(files / sites)
+    written: Dict[str, int] = {}
+    for s in range(sites):
+        folder = os.path.join(root, f"site_{s:02d}")
+        os.makedirs(folder, exist_ok=True)
+        n = 0
+        for i in range(per_site):
+            if rng.random() < gap_rate:
+                continue
+            d = start + timedelta(days=i // 24)
+            name = project.CHUNK_TEMPLATE.format(date=d.isoformat(), hour=i % 24)
+            with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+                f.write(synthetic_chunk(d, i % 24, rng, noise, file_size))
+            n += 1
+        written[folder] = n
+    return written
+
+
+# ---------- Suite ----------
+
+def _latencies(fn: Callable[[], Any], calls: int) -> Dict[str, float]:
+    """
+    Time `calls` separate calls of fn: throughput plus p50/p99 in microseconds.
+    """
+    times: List[float] = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        t = time.perf_counter_ns()
+        fn()
+        times.append((time.perf_counter_ns() - t) / 1000)
+    total = time.perf_counter() - start
+    times.sort()
+    return {
+        "calls": calls,
+        "total_s": total,
+        "calls_per_s": calls / total if total else math.inf,
+        "p50_us": project._percentile(times, 50),
+        "p99_us": project._percentile(times, 99),
+    }
+
+
+def peak_rss_kb() -> int:
+    """
+    Peak resident set size of this process in KB (ru_maxrss is bytes on macOS).
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def bench_archive(folders: List[str], calls: int = 200, seed: int = 0) -> Dict[str, Any]:
+    """
+    Time the inspector's hot paths against already generated site folders.
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    indexes = [project.index_chunks(f) for f in folders]
+    index_s = time.perf_counter() - start
+    n_files = sum(len(h) for idx in indexes for h in idx.by_date.values())
+    result: Dict[str, Any] = {
+        "index_chunks": {"files": n_files, "total_s": index_s, "files_per_s": n_files / index_s if index_s else math.inf},
+    }
+
+    targets = [(idx, d) for idx in indexes for d in idx.dates()]
+    if not targets:
+        return result
+    paths = [p for idx, d in targets[:50] for p in idx.hour_paths(d).values()]
+    texts = [project.read_file(p) for p in paths]
+    counter = itertools.count()
+    result["parse_chunk_text"] = _latencies(
+        lambda: project.parse_chunk_text(texts[next(counter) % len(texts)]), calls * 10
+    )
+
+    picks = [rng.choice(targets) for _ in range(calls)]
+    it = iter(picks)
+    result["query_day"] = _latencies(lambda: project.query_day(*next(it), fields=["co2", "temperature"]), calls)
+    it = iter(picks)
+    result["query_hours"] = _latencies(
+        lambda: project.query_hours(*next(it), hours=sorted(rng.sample(range(24), 3)), fields=["pm25"]), calls
+    )
+    big = max(indexes, key=lambda idx: idx.day_count)
+    result["inspection_report"] = _latencies(lambda: project.inspection_report(big), max(1, min(calls, 20)))
+    return result
+
+
+def _bench_child(folders: List[str], calls: int) -> Dict[str, Any]:
+    """
+    bench_archive in a fresh process: the peak RSS is this size's alone.
+    """
+    result = bench_archive(folders, calls)
+    result["peak_rss_kb"] = peak_rss_kb()
+    return result
+
+
+def run_suite(sizes: List[int], sites: int = 1, gap_rate: float = 0.0, noise: float = 1.0,
+              file_size: int = 0, calls: int = 200, workdir: Optional[str] = None, keep: bool = False) -> Dict[str, Any]:
+    """
+    Generate and benchmark one archive per size; returns the JSON report.
+    """
+    report: Dict[str, Any] = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"sites": sites, "gap_rate": gap_rate, "noise": noise, "file_size": file_size, "calls": calls},
+        "runs": [],
+    }
+    for files in sizes:
+        root = tempfile.mkdtemp(prefix=f"iot_bench_{files}_", dir=workdir)
+        try:
+            t = time.perf_counter()
+            written = generate_archive(root, files, sites, gap_rate, noise, file_size)
+            run: Dict[str, Any] = {"files": sum(written.values()), "generate_s": time.perf_counter() - t}
+            # spawn, not fork: a forked child inherits the parent's RSS high-water mark
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as ex:
+                run.update(ex.submit(_bench_child, sorted(written), calls).result())
+            report["runs"].append(run)
+            if keep:
+                run["archive"] = root
+        finally:
+            if not keep:
+                shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="IoT inspector microbenchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p_parse = sub.add_parser("parse", help="parse_chunk_text throughput")
+    p_parse.add_argument("--chunks", type=int, default=1_000_000)
+    p_parse.add_argument("--file", help="chunk file to parse instead of SAMPLE")
+    p_suite = sub.add_parser("suite", help="synthetic archive benchmark suite")
+    p_suite.add_argument("--files", type=int, nargs="+", default=[1000, 10000, 100000],
+                         help="archive sizes to generate (total files)")
+    p_suite.add_argument("--sites", type=int, default=1)
+    p_suite.add_argument("--gap-rate", type=float, default=0.0, help="probability an hour is missing")
+    p_suite.add_argument("--noise", type=float, default=1.0, help="scale of random field variation")
+    p_suite.add_argument("--file-size", type=int, default=0, help="pad each chunk to at least N bytes")
+    p_suite.add_argument("--calls", type=int, default=200, help="timed calls per query benchmark")
+    p_suite.add_argument("--workdir", help="where to generate archives (default: system temp)")
+    p_suite.add_argument("--keep", action="store_true", help="keep generated archives")
+    p_suite.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args()
+
+    if args.bench == "parse":
+        text = project.read_file(args.file) if args.file else SAMPLE
+        r = bench_parse(args.chunks, text)
+        print(f"chunks:        {r['chunks']:,}")
+        print(f"per-pattern:   {r['per_pattern_s']:.2f}s ({r['per_pattern_chunks_per_s']:,.0f} chunks/s)")
+        print(f"single-pass:   {r['single_pass_s']:.2f}s ({r['single_pass_chunks_per_s']:,.0f} chunks/s)")
+        print(f"speedup:       {r['speedup']:.2f}x")
+    elif args.bench == "suite":
+        report = run_suite(args.files, args.sites, args.gap_rate, args.noise, args.file_size,
+                           args.calls, args.workdir, args.keep)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        for run in report["runs"]:
+            line = [f"{run['files']:>9,} files", f"index {run['index_chunks']['files_per_s']:,.0f} files/s"]
+            for name in ("parse_chunk_text", "query_day", "query_hours", "inspection_report"):
+                if name in run:
+                    line.append(f"{name} p50 {run[name]['p50_us']:,.0f}us p99 {run[name]['p99_us']:,.0f}us")
+            line.append(f"rss {run['peak_rss_kb'] / 1024:,.0f} MB")
+            print(" | ".join(line))
+        print(f"results: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,19 +8,85 @@ IoT Data Inspector & Query Tool
     - Date only (YYYYMMDD or YYYY-MM-DD): return selected fields for all 24 hours
     - Date + hours (e.g., "3:00, 16:00"): return selected fields for those hours
     - If no fields specified, return the entire file content for the target scope
+    - Date ranges (START..END) stream hour rows in order, read on a thread pool
+- Chunks may also be gzip-compressed (.txt.gz) or members of .zip/.tar/.tar.gz/.tar.zst bundles
+- Index and parse caches; single-pass field parser with field projection
+- Multi-site indexing, file watcher (inotify or polling), local HTTP JSON service
+- Numeric parsing, columnar store and per-day/week/month aggregates
+- Binary archive, columnar export, SQLite store
+- Gap/outage analysis, threshold alerts, rollup tiers with quantile sketches,
+  full-text search
+- Batch CLI (subcommands; see build_arg_parser) and opt-in stage instrumentation
 
 """
 
 from __future__ import annotations
 import re
 import os
+import json
+import sys
+import argparse
+import asyncio
+import atexit
+import base64
+import cProfile
+import csv
+import ctypes
+import ctypes.util
+import gzip
+import hashlib
+import math
+import mmap
+import operator
+import select
+import shlex
+import shutil
+import sqlite3
+import struct
+import tarfile
+import threading
+import time
+import warnings
+import zipfile
+from array import array
+from urllib.parse import parse_qs, urlsplit
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple
-from datetime import datetime, date
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from datetime import datetime, date, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # optional: columnar code falls back to array.array
+    np = None
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for .tar.zst bundles
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional: export_columnar falls back to CSV
+    pyarrow = None
 
 FILENAME_RE = re.compile(
-    r"^chunk_(\d{4})-(\d{2})-(\d{2})_(\d{2})\.txt$"
+    r"^chunk_(\d{4})-(\d{2})-(\d{2})_(\d{2})\.txt(?:\.gz)?$"
 )
+# bundles of chunk files (e.g. one per month), read member by member
+BUNDLE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.zst")
+# a chunk inside a bundle is indexed as "<bundle path>::<member name>"
+MEMBER_SEP = "::"
+# inverse of FILENAME_RE, for indexes that rebuild paths instead of storing them
+CHUNK_TEMPLATE = "chunk_{date}_{hour:02d}.txt"
+
+# Sidecar written into the data folder by index_chunks_cached()
+INDEX_FILENAME = ".chunk_index.json"
+INDEX_VERSION = 3
 
 # ---------- Utility parsing ----------
 
@@ -34,6 +100,21 @@ def parse_date_string(s: str) -> date:
     return datetime.strptime(s, "%Y-%m-%d").date()
 
 
+def parse_date_range_string(s: str) -> Tuple[date, date]:
+    """
+    parse 'START..END' (each YYYYMMDD or YYYY-MM-DD) to (start, end).
+    A single date gives (d, d).
+    """
+    if ".." in s:
+        a, b = s.split("..", 1)
+        start, end = parse_date_string(a), parse_date_string(b)
+    else:
+        start = end = parse_date_string(s)
+    if end < start:
+        raise ValueError(f"Range end {end} is before start {start}")
+    return start, end
+
+
 def parse_hours_string(s: str) -> List[int]:
     """
     Parse hours list like: '3:00, 16:00, 21' -> [3,16,21]
@@ -98,6 +179,21 @@ class ChunkIndex:
     def add(self, date_str: str, hour: int, path: str) -> None:
         self.by_date.setdefault(date_str, {})[hour] = path
 
+    def remove(self, date_str: str, hour: int) -> Optional[str]:
+        by_hour = self.by_date.get(date_str)
+        if by_hour is None:
+            return None
+        path = by_hour.pop(hour, None)
+        if not by_hour:
+            del self.by_date[date_str]
+        return path
+
+    def hour_paths(self, date_str: str) -> Dict[int, str]:
+        return self.by_date.get(date_str, {})
+
+    def dates(self) -> List[str]:
+        return sorted(self.by_date)
+
     @property
     def day_count(self) -> int:
         return len(self.by_date)
@@ -120,185 +216,3701 @@ class ChunkIndex:
         return [h for h in range(24) if h not in have]
 
 
+def match_chunk_name(name: str) -> Optional[Tuple[str, int]]:
+    """
+    'chunk_2025-09-11_01.txt' -> ('2025-09-11', 1); None if not a chunk file.
+    """
+    m = FILENAME_RE.match(name)
+    if not m:
+        return None
+    yyyy, mm, dd, hh = m.groups()
+    return f"{yyyy}-{mm}-{dd}", int(hh)
+
+
+def is_bundle_name(name: str) -> bool:
+    return name.lower().endswith(BUNDLE_SUFFIXES)
+
+
+def _chunk_rank(path: str) -> int:
+    """
+    Precedence of a chunk path when several hold the same hour (lower wins):
+    plain .txt file, .txt.gz file, bundle member, gzipped bundle member.
+    """
+    return (2 if MEMBER_SEP in path else 0) + (1 if path.endswith(".gz") else 0)
+
+
+def _add_chunk(idx: ChunkIndex, date_str: str, hour: int, path: str) -> bool:
+    """
+    idx.add unless the hour already has a path of higher precedence (or an
+    equal one: the first bundle in name order keeps the hour). Returns
+    whether `path` is now indexed.
+    """
+    current = idx.hour_paths(date_str).get(hour)
+    if current is not None and current != path and _chunk_rank(path) >= _chunk_rank(current):
+        return False
+    idx.add(date_str, hour, path)
+    return True
+
+
+def _add_bundle(idx: ChunkIndex, bundle: str) -> List[str]:
+    """
+    Index the chunk members of a bundle; a file for the same hour wins.
+    Returns the bundle's member names.
+    """
+    members = list_bundle(bundle)
+    for member in members:
+        key = match_chunk_name(os.path.basename(member))
+        if key is not None:
+            _add_chunk(idx, key[0], key[1], bundle + MEMBER_SEP + member)
+    return members
+
+
 def index_chunks(folder: str) -> ChunkIndex:
     idx = ChunkIndex()
+    bundles: List[str] = []
     for name in os.listdir(folder):
-        m = FILENAME_RE.match(name)
-        if not m:
+        key = match_chunk_name(name)
+        if key is None:
+            if is_bundle_name(name):
+                bundles.append(os.path.join(folder, name))
             continue
-        yyyy, mm, dd, hh = m.groups()
-        date_str = f"{yyyy}-{mm}-{dd}"
-        hour = int(hh)
+        date_str, hour = key
         full = os.path.join(folder, name)
-        idx.add(date_str, hour, full)
+        _add_chunk(idx, date_str, hour, full)
+    for bundle in sorted(bundles):
+        _add_bundle(idx, bundle)
+    return idx
+
+
+# ---------- Compact hour-mask index ----------
+
+FULL_DAY_MASK = (1 << 24) - 1
+
+
+def _popcount(n: int) -> int:
+    return bin(n).count("1")
+
+
+class MaskIndex:
+    """
+    Compact alternative to ChunkIndex: one 24-bit hour mask per day, kept in
+    two parallel sorted arrays (day ordinal, mask). Paths are not stored but
+    derived from CHUNK_TEMPLATE, so an index of years of days is a few KB.
+    Coverage, missing hours and range lookups are bisects and bit operations.
+    Offers the ChunkIndex methods used by queries and inspection_report.
+    Only plain CHUNK_TEMPLATE files fit; compressed chunks need a ChunkIndex.
+    """
+
+    def __init__(self, folder: str, template: str = CHUNK_TEMPLATE) -> None:
+        self.folder = folder
+        self.template = template
+        self._days = array("i")
+        self._masks = array("I")
+
+    @classmethod
+    def from_chunk_index(cls, idx: ChunkIndex, folder: str) -> "MaskIndex":
+        """
+        Convert a ChunkIndex of plain template files in `folder`; raises
+        ValueError for any other path (.txt.gz, bundle member, subfolder),
+        which a MaskIndex could not point back to.
+        """
+        for d, by_hour in idx.by_date.items():
+            for h, path in by_hour.items():
+                if path != os.path.join(folder, CHUNK_TEMPLATE.format(date=d, hour=h)):
+                    raise ValueError(f"Not a plain chunk file in {folder}: {path}")
+        out = cls(folder)
+        for d, mask in sorted(_hour_masks(idx).items()):
+            out._days.append(parse_date_string(d).toordinal())
+            out._masks.append(mask)
+        return out
+
+    @classmethod
+    def scan(cls, folder: str) -> "MaskIndex":
+        """
+        Build directly from a folder listing, without a ChunkIndex in between.
+        """
+        masks: Dict[int, int] = {}
+        for name in os.listdir(folder):
+            key = match_chunk_name(name)
+            if key is not None and name == CHUNK_TEMPLATE.format(date=key[0], hour=key[1]):
+                ordinal = parse_date_string(key[0]).toordinal()
+                masks[ordinal] = masks.get(ordinal, 0) | 1 << key[1]
+        out = cls(folder)
+        for ordinal in sorted(masks):
+            out._days.append(ordinal)
+            out._masks.append(masks[ordinal])
+        return out
+
+    def _find(self, date_str: str) -> Tuple[int, int, bool]:
+        ordinal = parse_date_string(date_str).toordinal()
+        i = bisect_left(self._days, ordinal)
+        return ordinal, i, i < len(self._days) and self._days[i] == ordinal
+
+    def _span(self, start: Optional[DateLike], end: Optional[DateLike]) -> Tuple[int, int]:
+        """
+        Array slice [lo, hi) of the days between start and end inclusive.
+        """
+        lo = 0 if start is None else bisect_left(self._days, _as_date(start).toordinal())
+        hi = len(self._days) if end is None else bisect_right(self._days, _as_date(end).toordinal())
+        return lo, hi
+
+    def add(self, date_str: str, hour: int, path: Optional[str] = None) -> None:
+        ordinal, i, found = self._find(date_str)
+        if found:
+            self._masks[i] |= 1 << hour
+        else:
+            self._days.insert(i, ordinal)
+            self._masks.insert(i, 1 << hour)
+
+    def remove(self, date_str: str, hour: int) -> Optional[str]:
+        _, i, found = self._find(date_str)
+        if not found or not self._masks[i] >> hour & 1:
+            return None
+        self._masks[i] &= ~(1 << hour) & FULL_DAY_MASK
+        if not self._masks[i]:
+            del self._days[i]
+            del self._masks[i]
+        return self.path(date_str, hour, check=False)
+
+    def mask(self, date_str: str) -> int:
+        _, i, found = self._find(date_str)
+        return self._masks[i] if found else 0
+
+    def path(self, date_str: str, hour: int, check: bool = True) -> Optional[str]:
+        if check and not self.mask(date_str) >> hour & 1:
+            return None
+        return os.path.join(self.folder, self.template.format(date=date_str, hour=hour))
+
+    def hour_paths(self, date_str: str) -> Dict[int, str]:
+        mask = self.mask(date_str)
+        return {h: self.path(date_str, h, check=False) for h in range(24) if mask >> h & 1}
+
+    def dates(self, start: Optional[DateLike] = None, end: Optional[DateLike] = None) -> List[str]:
+        lo, hi = self._span(start, end)
+        return [date.fromordinal(o).isoformat() for o in self._days[lo:hi]]
+
+    @property
+    def day_count(self) -> int:
+        return len(self._days)
+
+    def date_range(self) -> Tuple[str, str]:
+        if not self._days:
+            return ("N/A", "N/A")
+        first_mask, last_mask = self._masks[0], self._masks[-1]
+        first_h = (first_mask & -first_mask).bit_length() - 1
+        last_h = last_mask.bit_length() - 1
+        start = f"{date.fromordinal(self._days[0]).isoformat()} {first_h:02d}:00"
+        end = f"{date.fromordinal(self._days[-1]).isoformat()} {last_h:02d}:59"
+        return start, end
+
+    def missing_hours(self, date_str: str) -> List[int]:
+        missing = ~self.mask(date_str) & FULL_DAY_MASK
+        return [h for h in range(24) if missing >> h & 1]
+
+    def coverage(self, start: Optional[DateLike] = None, end: Optional[DateLike] = None) -> Tuple[int, int]:
+        """
+        (hours present, calendar hours) from start to end inclusive,
+        defaulting to the first and last indexed day.
+        """
+        if not self._days:
+            return 0, 0
+        lo, hi = self._span(start, end)
+        first = _as_date(start).toordinal() if start is not None else self._days[0]
+        last = _as_date(end).toordinal() if end is not None else self._days[-1]
+        present = sum(_popcount(m) for m in self._masks[lo:hi])
+        return present, max(0, last - first + 1) * 24
+
+    def incomplete_days(self, start: Optional[DateLike] = None,
+                        end: Optional[DateLike] = None) -> List[Tuple[str, int]]:
+        """
+        (date_str, mask of missing hours) for indexed days that are not complete.
+        """
+        lo, hi = self._span(start, end)
+        return [
+            (date.fromordinal(o).isoformat(), ~m & FULL_DAY_MASK)
+            for o, m in zip(self._days[lo:hi], self._masks[lo:hi])
+            if m != FULL_DAY_MASK
+        ]
+
+    def to_chunk_index(self) -> ChunkIndex:
+        idx = ChunkIndex()
+        for d in self.dates():
+            for h, path in self.hour_paths(d).items():
+                idx.add(d, h, path)
+        return idx
+
+
+# ---------- Persistent index ----------
+
+def _hour_masks(idx: ChunkIndex) -> Dict[str, int]:
+    """
+    Encode the index as date_str -> 24-bit mask (bit h set = hour h present).
+    """
+    masks: Dict[str, int] = {}
+    for d, by_hour in idx.by_date.items():
+        mask = 0
+        for h in by_hour:
+            mask |= 1 << h
+        masks[d] = mask
+    return masks
+
+
+def save_index(idx: ChunkIndex, folder: str, index_path: str, mtime_ns: int,
+               bundles: Optional[Dict[str, Tuple[int, int]]] = None) -> None:
+    """
+    Write the index as a compact JSON sidecar.
+    Plain chunk paths are not stored; they are rebuilt from the filename
+    template on load. Others (.txt.gz, bundle members) are stored relative
+    to the folder. `bundles` (name -> file_stamp, taken before the scan) lets
+    load_index notice a bundle rewritten in place, which leaves the folder
+    mtime alone.
+    """
+    masks: Dict[str, int] = {}
+    other: Dict[str, Dict[int, str]] = {}
+    for d, by_hour in idx.by_date.items():
+        for h, path in by_hour.items():
+            if path == os.path.join(folder, CHUNK_TEMPLATE.format(date=d, hour=h)):
+                masks[d] = masks.get(d, 0) | 1 << h
+            else:
+                other.setdefault(d, {})[h] = os.path.relpath(path, folder)
+    payload = {
+        "version": INDEX_VERSION,
+        "dirs": {
+            os.path.abspath(folder): {"mtime_ns": mtime_ns, "days": masks, "other": other,
+                                      "bundles": bundles or {}},
+        },
+    }
+    # Rewrite in place: replacing the file would bump the folder mtime again.
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, separators=(",", ":"))
+
+
+def load_index(folder: str, index_path: str) -> Optional[ChunkIndex]:
+    """
+    Load a sidecar written by save_index.
+    Returns None if it is missing, unreadable, or the folder changed since.
+    """
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        entry = payload["dirs"][os.path.abspath(folder)]
+        if payload.get("version") != INDEX_VERSION:
+            return None
+        if entry["mtime_ns"] != os.stat(folder).st_mtime_ns:
+            return None
+        for name, stamp in entry["bundles"].items():
+            if list(file_stamp(os.path.join(folder, name))) != stamp:
+                return None
+        masks = entry["days"]
+        other = entry["other"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    idx = ChunkIndex()
+    for d, mask in masks.items():
+        for h in range(24):
+            if mask >> h & 1:
+                idx.add(d, h, os.path.join(folder, CHUNK_TEMPLATE.format(date=d, hour=h)))
+    for d, by_hour in other.items():
+        for h, rel in by_hour.items():
+            idx.add(d, int(h), os.path.join(folder, rel))
+    return idx
+
+
+def index_chunks_cached(folder: str, index_path: Optional[str] = None) -> ChunkIndex:
+    """
+    Like index_chunks, but reuse the sidecar index when the folder is unchanged.
+    A changed folder mtime (file added, removed or renamed) triggers a rescan
+    and the sidecar is refreshed.
+    """
+    if index_path is None:
+        index_path = os.path.join(folder, INDEX_FILENAME)
+    idx = load_index(folder, index_path)
+    if idx is not None:
+        return idx
+    try:
+        # Create the sidecar first so its own creation is part of the
+        # recorded mtime, and stat before scanning so files landing during
+        # the scan force a rescan next time.
+        if not os.path.exists(index_path):
+            open(index_path, "a", encoding="utf-8").close()
+        mtime_ns = os.stat(folder).st_mtime_ns
+        bundles = {n: file_stamp(os.path.join(folder, n)) for n in os.listdir(folder) if is_bundle_name(n)}
+    except OSError:
+        # read-only folder: fall back to a plain scan
+        return index_chunks(folder)
+    idx = index_chunks(folder)
+    try:
+        save_index(idx, folder, index_path, mtime_ns, bundles)
+    except OSError:
+        pass
     return idx
 
 
 # ---------- Parsing a chunk file ----------
 
+FIELD_LABELS = {
+    "temperature": r"temperature",
+    "humidity": r"humidity",
+    "ieq": r"ieq(?:\s*median)?",
+    "co2": r"co[2₂o]",
+    "pm25": r"pm\s*2\.?5",
+    "illuminance": r"illuminance",
+}
+
 FIELD_PATTERNS = {
-    "temperature": re.compile(r"^temperature:\s*(.+)$", re.I),
-    "humidity": re.compile(r"^humidity:\s*(.+)$", re.I),
-    "ieq": re.compile(r"^ieq(?:\s*median)?:\s*(.+)$", re.I),
-    "co2": re.compile(r"^co[2₂o]:\s*(.+)$", re.I),
-    "pm25": re.compile(r"^pm\s*2\.?5:\s*(.+)$", re.I),
-    "illuminance": re.compile(r"^illuminance:\s*(.+)$", re.I),
+    key: re.compile(rf"^{label}:\s*(.+)$", re.I) for key, label in FIELD_LABELS.items()
 }
 
-def parse_chunk_text(text: str) -> Dict[str, str]:
+ALL_FIELDS = frozenset(FIELD_LABELS)
+
+# All field labels as one alternation, matched line by line over the whole
+# text in a single finditer() pass. Same semantics as FIELD_PATTERNS applied
+# to each stripped line; whitespace never crosses a line break.
+FIELD_LINE_RE = re.compile(
+    r"^[^\S\n]*("
+    + "|".join(label.replace(r"\s", r"[^\S\n]") for label in FIELD_LABELS.values())
+    + r"):[^\S\n]*(\S.*)$",
+    re.I | re.M,
+)
+
+# The first two letters of a matched label identify its field.
+LABEL_PREFIX_KEYS = {
+    "te": "temperature",
+    "hu": "humidity",
+    "ie": "ieq",
+    "co": "co2",
+    "pm": "pm25",
+    "il": "illuminance",
+}
+
+
+def extract_fields(text: str, wanted: Optional[frozenset] = None) -> Dict[str, str]:
+    """
+    Single pass over text: each field line is classified once by
+    FIELD_LINE_RE, the first occurrence of a field wins, and scanning
+    stops as soon as every wanted field (default: all) has been seen.
+    """
+    if wanted is None:
+        wanted = ALL_FIELDS
+    out: Dict[str, str] = {}
+    need = len(wanted)
+    if not need:
+        return out
+    for m in FIELD_LINE_RE.finditer(text):
+        key = LABEL_PREFIX_KEYS[m.group(1)[:2].lower()]
+        if key in wanted and key not in out:
+            out[key] = m.group(2).strip()
+            if len(out) == need:
+                break
+    return out
+
+
+def parse_chunk_text(text: str, fields: Optional[frozenset] = None) -> Dict[str, str]:
     """
     Return dict with canonical keys if found in the text.
     Values are the text following the field label (string).
     Also includes the raw text as 'raw'.
+    With `fields` (a set of canonical keys, see normalize_fields), only
+    those are extracted, and 'raw' is built only if it is in the set.
     """
-    out: Dict[str, str] = {}
-    for line in text.splitlines():
-        line = line.strip()
-        for key, pat in FIELD_PATTERNS.items():
-            m = pat.match(line)
-            if m and key not in out:
-                out[key] = m.group(1).strip()
-    out["raw"] = text.strip()
+    if fields is None:
+        out = extract_fields(text)
+        out["raw"] = text.strip()
+        return out
+    out = extract_fields(text, fields & ALL_FIELDS)
+    if "raw" in fields:
+        out["raw"] = text.strip()
     return out
 
 
 def read_file(path: str) -> str:
+    if MEMBER_SEP in path:
+        return read_bundle_member(*path.split(MEMBER_SEP, 1))
+    if path.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return f.read()
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
 
+def file_stamp(path: str) -> Tuple[int, int]:
+    """
+    (mtime_ns, size) identifying a chunk's current content; for a bundle
+    member, that of the bundle.
+    """
+    st = os.stat(path.split(MEMBER_SEP, 1)[0])
+    return st.st_mtime_ns, st.st_size
+
+
+# ---------- Compressed bundles ----------
+
+class _BundleClosed(Exception):
+    """
+    The bundle was closed (rewritten or evicted) before a read got its lock.
+    """
+
+
+class _OpenBundle:
+    """
+    An open zip/tar bundle, reused across member reads while unchanged.
+    A .tar.zst bundle can't seek, so it is decoded once into member -> bytes.
+    """
+
+    def __init__(self, path: str, stamp: Tuple[int, int]) -> None:
+        self.stamp = stamp
+        self.lock = threading.Lock()
+        self.closed = False
+        self.members: Optional[Dict[str, bytes]] = None
+        self.handle: Any = None
+        if path.lower().endswith(".tar.zst"):
+            self.members = {m.name: f.read() for m, f in _zstd_tar_members(path)}
+        elif path.lower().endswith(".zip"):
+            self.handle = zipfile.ZipFile(path)
+        else:
+            self.handle = tarfile.open(path, "r:*")
+
+    def names(self) -> List[str]:
+        with self.lock:
+            if self.closed:
+                raise _BundleClosed()
+            if self.members is not None:
+                return list(self.members)
+            if isinstance(self.handle, zipfile.ZipFile):
+                return self.handle.namelist()
+            return [m.name for m in self.handle.getmembers() if m.isfile()]
+
+    def read(self, member: str) -> bytes:
+        with self.lock:
+            if self.closed:
+                raise _BundleClosed()
+            if self.members is not None:
+                if member not in self.members:
+                    raise FileNotFoundError(member)
+                return self.members[member]
+            if isinstance(self.handle, zipfile.ZipFile):
+                with self.handle.open(member) as f:
+                    return f.read()
+            f = self.handle.extractfile(member)
+            if f is None:
+                raise FileNotFoundError(member)
+            return f.read()
+
+    def close(self) -> None:
+        # waits for a read in progress; later ones see `closed` and reopen
+        with self.lock:
+            self.closed = True
+            self.members = None
+            if self.handle is not None:
+                self.handle.close()
+
+
+_open_bundles: "OrderedDict[str, _OpenBundle]" = OrderedDict()
+_open_bundles_lock = threading.Lock()
+MAX_OPEN_BUNDLES = 8
+
+
+def _bundle(path: str) -> _OpenBundle:
+    stamp = file_stamp(path)
+    stale: List[_OpenBundle] = []
+    with _open_bundles_lock:
+        b = _open_bundles.get(path)
+        if b is not None and b.stamp == stamp and not b.closed:
+            _open_bundles.move_to_end(path)
+            return b
+        if b is not None:
+            stale.append(b)
+        b = _open_bundles[path] = _OpenBundle(path, stamp)
+        while len(_open_bundles) > MAX_OPEN_BUNDLES:
+            stale.append(_open_bundles.popitem(last=False)[1])
+    # closed outside the registry lock: close() waits for reads in progress
+    for old in stale:
+        old.close()
+    return b
+
+
+def _zstd_tar_members(path: str) -> Iterator[Tuple[tarfile.TarInfo, Any]]:
+    """
+    Stream a .tar.zst bundle front to back as (member, file object).
+    """
+    if zstandard is None:
+        raise RuntimeError(f"zstandard is required to read {path}")
+    with open(path, "rb") as raw:
+        with zstandard.ZstdDecompressor().stream_reader(raw) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                for member in tar:
+                    if member.isfile():
+                        yield member, tar.extractfile(member)
+
+
+def list_bundle(path: str) -> List[str]:
+    """
+    Member names of a bundle (directory index only, nothing is extracted,
+    except for .tar.zst, which is decoded once and kept open).
+    """
+    while True:
+        try:
+            return _bundle(path).names()
+        except _BundleClosed:
+            continue
+
+
+def read_bundle_member(path: str, member: str) -> str:
+    """
+    Decompress one member straight into memory; nothing touches the disk.
+    zip members are decoded independently. Plain .tar seeks to the member;
+    gzip-compressed tar re-decodes from the start when seeking backwards.
+    .tar.zst members come from the bundle's one-time decode.
+    A .txt.gz member is gunzipped as well.
+    """
+    while True:
+        try:
+            data = _bundle(path).read(member)
+        except _BundleClosed:
+            continue
+        except FileNotFoundError:
+            raise FileNotFoundError(f"{member} not in {path}") from None
+        if member.endswith(".gz"):
+            data = gzip.decompress(data)
+        return data.decode("utf-8")
+
+
+# ---------- Parse cache ----------
+
+class ParseCache:
+    """
+    Bounded LRU cache of parsed chunk dicts.
+    Entries are keyed on path plus field projection and validated against
+    (mtime_ns, size), so a rewritten file is re-read instead of served stale.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # (path, fields) -> (stamp, parsed dict, estimated size)
+        self._entries: "OrderedDict[Tuple[str, Optional[frozenset]], Tuple[Tuple[int, int], Dict[str, str], int]]" = OrderedDict()
+        # path -> cached projections of it
+        self._keys_by_path: Dict[str, set] = {}
+        # query_range() shares one cache across worker threads
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self, path: str, fields: Optional[frozenset] = None) -> Dict[str, str]:
+        stamp = file_stamp(path)
+        key = (path, fields)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                # file changed: every projection of it is stale
+                self._invalidate(path)
+        # read and parse outside the lock so threads overlap on I/O
+        data = parse_chunk_text(read_file(path), fields)
+        with self._lock:
+            self._store(key, stamp, data)
+        return data
+
+    def invalidate(self, path: str) -> None:
+        with self._lock:
+            self._invalidate(path)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _invalidate(self, path: str) -> None:
+        for key in self._keys_by_path.pop(path, ()):
+            self.bytes -= self._entries.pop(key)[2]
+
+    def _store(self, key: Tuple[str, Optional[frozenset]], stamp: Tuple[int, int], data: Dict[str, str]) -> None:
+        size = sys.getsizeof(key[0]) + sys.getsizeof(data)
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in data.items())
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            # another thread stored it meanwhile
+            self.bytes -= self._entries.pop(key)[2]
+        self._entries[key] = (stamp, data, size)
+        self._keys_by_path.setdefault(key[0], set()).add(key)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old_key, (_, _, old_size) = self._entries.popitem(last=False)
+            self.bytes -= old_size
+            keys = self._keys_by_path[old_key[0]]
+            keys.discard(old_key)
+            if not keys:
+                del self._keys_by_path[old_key[0]]
+
+
+def load_chunk(path: str, cache: Optional[ParseCache] = None,
+               fields: Optional[frozenset] = None) -> Dict[str, str]:
+    """
+    Read and parse one chunk file, through the cache when one is given.
+    """
+    if cache is None:
+        return parse_chunk_text(read_file(path), fields)
+    return cache.load(path, fields)
+
+
 # ---------- Queries ----------
 
-def query_day(idx: ChunkIndex, date_str: str, fields: Optional[List[str]] = None) -> Dict[int, Dict[str, str]]:
+RAW_ONLY = frozenset({"raw"})
+
+
+def normalize_fields(fields: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Canonical keys for a user field list, de-duplicated, order kept.
+    None (or empty) means "no fields": return the raw text.
+    """
+    if not fields:
+        return None
+    out: List[str] = []
+    for f in fields:
+        key = normalize_field_name(f)
+        if key not in out:
+            out.append(key)
+    return out
+
+
+def _project(path: str, keys: Optional[List[str]], cache: Optional[ParseCache]) -> Dict[str, str]:
+    """
+    Parse one chunk for a query: only the requested fields, or only 'raw'.
+    """
+    if keys:
+        data = load_chunk(path, cache, frozenset(keys))
+        return {k: data[k] for k in keys if k in data}
+    return {"raw": load_chunk(path, cache, RAW_ONLY)["raw"]}
+
+
+def query_day(idx: ChunkIndex, date_str: str, fields: Optional[List[str]] = None,
+              cache: Optional[ParseCache] = None) -> Dict[int, Dict[str, str]]:
     """
     Return mapping hour -> {field:value} (or full 'raw' if fields is None).
     Missing hours are not included.
     """
-    by_hour = idx.by_date.get(date_str, {})
+    by_hour = idx.hour_paths(date_str)
+    keys = normalize_fields(fields)
     result: Dict[int, Dict[str, str]] = {}
     for h in sorted(by_hour.keys()):
-        data = parse_chunk_text(read_file(by_hour[h]))
-        if fields:
-            sub = {}
-            for f in fields:
-                key = normalize_field_name(f)
-                if key in data:
-                    sub[key] = data[key]
-            result[h] = sub
-        else:
-            result[h] = {"raw": data["raw"]}
+        result[h] = _project(by_hour[h], keys, cache)
     return result
 
 
-def query_hours(idx: ChunkIndex, date_str: str, hours: List[int], fields: Optional[List[str]] = None) -> Dict[int, Dict[str, str]]:
+def query_hours(idx: ChunkIndex, date_str: str, hours: List[int], fields: Optional[List[str]] = None,
+                cache: Optional[ParseCache] = None) -> Dict[int, Dict[str, str]]:
+    by_hour = idx.hour_paths(date_str)
+    keys = normalize_fields(fields)
     result: Dict[int, Dict[str, str]] = {}
     for h in sorted(hours):
-        path = idx.by_date.get(date_str, {}).get(h)
+        path = by_hour.get(h)
         if not path:
             result[h] = {"error": "file not found"}
             continue
-        data = parse_chunk_text(read_file(path))
-        if fields:
-            sub = {}
-            for f in fields:
-                key = normalize_field_name(f)
-                if key in data:
-                    sub[key] = data[key]
-            result[h] = sub
-        else:
-            result[h] = {"raw": data["raw"]}
+        result[h] = _project(path, keys, cache)
     return result
 
 
-# ---------- Reporting ----------
+DateLike = Union[str, date]
 
-def inspection_report(idx: ChunkIndex) -> str:
-    lines: List[str] = []
-    lines.append("=== Inspection Report ===")
-    lines.append(f"Days covered: {idx.day_count}")
-    start, end = idx.date_range()
-    lines.append(f"Date range: {start} -> {end}")
-    lines.append("Per‑day completeness (missing hours listed):")
-    for d in sorted(idx.by_date.keys()):
-        miss = idx.missing_hours(d)
-        if miss:
-            lines.append(f"  {d}: missing {', '.join(f'{h:02d} hour file' for h in miss)}")
-        else:
-            lines.append(f"  {d}: complete (24/24)")
-    # Also include dates that appear due to gaps? (Not applicable without a calendar source)
-    return "\n".join(lines)
 
+def _as_date(d: DateLike) -> date:
+    return d if isinstance(d, date) else parse_date_string(d)
 
-def format_query_output_day(result: Dict[int, Dict[str, str]], fields: Optional[List[str]]) -> str:
-    lines: List[str] = []
-    for h in range(24):
-        if h not in result:
-            continue
-        lines.append(f"[{h:02d}:00]")
-        if fields:
-            for k, v in result[h].items():
-                lines.append(f"  {k}: {v}")
-        else:
-            lines.append(result[h].get("raw", ""))
-        lines.append("")
-    return "\n".join(lines).strip()
+
+def _ordered_map(fn: Callable, items: Iterable, workers: int, window: int,
+                 executor: Callable[..., Executor] = ThreadPoolExecutor) -> Iterator:
+    """
+    Like map(fn, items), run on a pool (threads by default) with at most
+    `window` calls in flight; results come back in input order as soon as
+    they are ready.
+    """
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+    ex = executor(max_workers=workers)
+    pending: deque = deque()
+    try:
+        for item in items:
+            pending.append(ex.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        ex.shutdown(wait=True, cancel_futures=True)
 
 
-def format_query_output_hours(result: Dict[int, Dict[str, str]], fields: Optional[List[str]]) -> str:
-    lines: List[str] = []
-    for h in sorted(result.keys()):
-        lines.append(f"[{h:02d}:00]")
-        row = result[h]
-        if "error" in row:
-            lines.append(f"  ERROR: {row['error']}")
-        else:
-            if fields:
-                for k, v in row.items():
-                    lines.append(f"  {k}: {v}")
-            else:
-                lines.append(row.get("raw", ""))
-        lines.append("")
-    return "\n".join(lines).strip()
+def query_range(idx: ChunkIndex, start: DateLike, end: DateLike, hours: Optional[List[int]] = None,
+                fields: Optional[List[str]] = None, cache: Optional[ParseCache] = None,
+                workers: int = 8) -> Iterator[Tuple[str, int, Dict[str, str]]]:
+    """
+    Stream (date_str, hour, row) for every day from start to end inclusive,
+    in chronological order. Rows are shaped like query_day (no `hours`:
+    missing hours skipped) or query_hours (missing hours -> error row).
+    Files are read and parsed on `workers` threads so I/O waits overlap.
+    """
+    first, last = _as_date(start), _as_date(end)
+    keys = normalize_fields(fields)
+    wanted_hours = sorted(set(hours)) if hours else None
 
+    def targets() -> Iterator[Tuple[str, int, Optional[str]]]:
+        d = first
+        while d <= last:
+            date_str = d.strftime("%Y-%m-%d")
+            by_hour = idx.hour_paths(date_str)
+            for h in (wanted_hours if wanted_hours is not None else sorted(by_hour)):
+                yield date_str, h, by_hour.get(h)
+            d += timedelta(days=1)
 
-# ---------- CLI main ----------
+    def fetch(target: Tuple[str, int, Optional[str]]) -> Tuple[str, int, Dict[str, str]]:
+        date_str, h, path = target
+        if not path:
+            return date_str, h, {"error": "file not found"}
+        return date_str, h, _project(path, keys, cache)
 
-def main() -> None:
-    print("IoT Data Inspector & Query Tool")
-    folder = input("Data folder (where chunk_YYYY-MM-DD_HH.txt lives): ").strip() or "."
-    idx = index_chunks(folder)
-    while True:
-        print("\n" + "-" * 20)
-        print("Choose mode:")
-        print("  1) Inspect")
-        print("  2) Query")
-        print("  q) Quit")
-        choice = input("> ").strip().lower()
-        if choice == "1":
-            print(inspection_report(idx))
-        elif choice == "2":
-            date_in = input("Date (YYYYMMDD or YYYY-MM-DD): ").strip()
-            try:
-                d = parse_date_string(date_in)
-            except Exception as e:
-                print(f"Invalid date: {e}")
+    return _ordered_map(fetch, targets(), workers, window=max(1, workers) * 4)
+
+
+# ---------- Multi-site indexing ----------
+
+SiteIndex = Dict[str, ChunkIndex]
+
+
+def _scan_dir(path: str) -> Tuple[List[Tuple[str, int, str]], List[str]]:
+    """
+    One directory level: (chunk files as (date_str, hour, path), subdirectories).
+    """
+    chunks: List[Tuple[str, int, str]] = []
+    subdirs: List[str] = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
                 continue
-            date_str = d.strftime("%Y-%m-%d")
-            hours_in = input("Hours (e.g., '3:00, 16:00') or blank for whole day: ").strip()
-            fields_in = input("Fields (comma, case-insensitive; e.g. 'Temperature, CO2, IEQ median') or blank for ALL: ").strip()
-            fields = [f.strip() for f in fields_in.split(",")] if fields_in else None
-            if hours_in:
-                try:
-                    hours = parse_hours_string(hours_in)
-                except Exception as e:
-                    print(f"Invalid hours: {e}")
-                    continue
-                result = query_hours(idx, date_str, hours, fields)
-                print(format_query_output_hours(result, fields))
+            key = match_chunk_name(entry.name)
+            if key is not None:
+                chunks.append((key[0], key[1], entry.path))
+            elif is_bundle_name(entry.name):
+                for member in list_bundle(entry.path):
+                    key = match_chunk_name(os.path.basename(member))
+                    if key is not None:
+                        chunks.append((key[0], key[1], entry.path + MEMBER_SEP + member))
+    return chunks, subdirs
+
+
+def index_sites(roots: Union[str, List[str], Dict[str, str]], workers: int = 8) -> SiteIndex:
+    """
+    Index chunk trees under several roots (e.g. one per mount) in one
+    parallel walk: every directory is an os.scandir task on a shared thread
+    pool, so deep site/YYYY/MM/ trees and slow mounts overlap.
+    Site keys: with a list of roots, each top-level folder of a root is a
+    site (chunks directly in a root belong to the root's own name); with a
+    {site: root} dict, everything under a root belongs to that site.
+    The same site found under several roots is merged into one ChunkIndex.
+    """
+    if isinstance(roots, str):
+        roots = [roots]
+    if isinstance(roots, dict):
+        tasks = [(site, root) for site, root in roots.items()]
+    else:
+        tasks = [(None, root) for root in roots]
+
+    sites: SiteIndex = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        # future -> (site, or None while still at a root's top level; directory)
+        pending = {ex.submit(_scan_dir, path): (site, path) for site, path in tasks}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                site, path = pending.pop(fut)
+                chunks, subdirs = fut.result()
+                if chunks:
+                    key = site if site is not None else os.path.basename(os.path.abspath(path))
+                    idx = sites.setdefault(key, ChunkIndex())
+                    for date_str, hour, full in chunks:
+                        _add_chunk(idx, date_str, hour, full)
+                for sub in subdirs:
+                    sub_site = site if site is not None else os.path.basename(sub)
+                    pending[ex.submit(_scan_dir, sub)] = (sub_site, sub)
+    return sites
+
+
+def _site_targets(sites: SiteIndex, site: Optional[str]) -> List[str]:
+    if site is None:
+        return sorted(sites)
+    if site not in sites:
+        raise KeyError(f"Unknown site: {site}")
+    return [site]
+
+
+def query_sites_day(sites: SiteIndex, date_str: str, fields: Optional[List[str]] = None,
+                    site: Optional[str] = None, cache: Optional[ParseCache] = None,
+                    workers: int = 8) -> Dict[str, Dict[int, Dict[str, str]]]:
+    """
+    query_day on one site, or fanned out over all sites (site=None) in
+    parallel threads. Returns site -> query_day result.
+    """
+    names = _site_targets(sites, site)
+    results = _ordered_map(lambda s: query_day(sites[s], date_str, fields, cache), names,
+                           workers, window=max(1, workers))
+    return dict(zip(names, results))
+
+
+def query_sites_hours(sites: SiteIndex, date_str: str, hours: List[int], fields: Optional[List[str]] = None,
+                      site: Optional[str] = None, cache: Optional[ParseCache] = None,
+                      workers: int = 8) -> Dict[str, Dict[int, Dict[str, str]]]:
+    """
+    query_hours on one site or all of them; returns site -> query_hours result.
+    """
+    names = _site_targets(sites, site)
+    results = _ordered_map(lambda s: query_hours(sites[s], date_str, hours, fields, cache), names,
+                           workers, window=max(1, workers))
+    return dict(zip(names, results))
+
+
+# ---------- Watching for new files ----------
+
+class _Inotify:
+    """
+    Minimal Linux inotify binding (ctypes) for one directory.
+    """
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+    def __init__(self, folder: str) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(folder), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, f"inotify_add_watch failed for {folder}")
+        self.fd = fd
+
+    def read_events(self) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (mask, filename) for every queued event, without blocking.
+        """
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            pos = 0
+            while pos < len(buf):
+                _, mask, _, length = self.EVENT.unpack_from(buf, pos)
+                pos += self.EVENT.size
+                name = os.fsdecode(buf[pos:pos + length].rstrip(b"\0"))
+                pos += length
+                yield mask, name
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class ChunkWatcher:
+    """
+    Keep a ChunkIndex current while chunk files and bundles land in (or
+    leave) folder. Uses inotify where available; otherwise poll() costs one
+    stat of the folder and lists it only when its mtime changed. Rewritten
+    or removed files are dropped from the parse cache.
+    """
+
+    def __init__(self, idx: ChunkIndex, folder: str, cache: Optional[ParseCache] = None,
+                 use_inotify: bool = True) -> None:
+        self.idx = idx
+        self.folder = folder
+        self.cache = cache
+        self._inotify: Optional[_Inotify] = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify(folder)
+            except (OSError, AttributeError):
+                self._inotify = None
+        self._mtime_ns = os.stat(folder).st_mtime_ns
+        # names already indexed (chunk files and bundles), to diff against a fresh listing
+        self._names = {
+            os.path.basename(p.split(MEMBER_SEP, 1)[0])
+            for by_hour in idx.by_date.values() for p in by_hour.values()
+        }
+        # bundle path -> member names, listed on first use
+        self._members: Dict[str, List[str]] = {}
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._inotify is not None else "polling"
+
+    def fileno(self) -> Optional[int]:
+        return self._inotify.fd if self._inotify is not None else None
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def poll(self) -> int:
+        """
+        Apply pending changes to the index; return how many files changed.
+        """
+        if self._inotify is not None:
+            changed = 0
+            for mask, name in self._inotify.read_events():
+                if mask & _Inotify.IN_Q_OVERFLOW:
+                    changed += self._resync()
+                elif mask & (_Inotify.IN_DELETE | _Inotify.IN_MOVED_FROM):
+                    changed += self._removed(name)
+                else:
+                    changed += self._landed(name)
+            return changed
+        mtime_ns = os.stat(self.folder).st_mtime_ns
+        if mtime_ns == self._mtime_ns:
+            return 0
+        self._mtime_ns = mtime_ns
+        return self._resync()
+
+    def _resync(self) -> int:
+        names = {n for n in os.listdir(self.folder) if match_chunk_name(n) or is_bundle_name(n)}
+        changed = 0
+        for name in names - self._names:
+            changed += self._landed(name)
+        for name in self._names - names:
+            changed += self._removed(name)
+        return changed
+
+    def _bundle_members(self, bundle: str) -> List[str]:
+        if bundle not in self._members:
+            self._members[bundle] = list_bundle(bundle)
+        return self._members[bundle]
+
+    def _drop_bundle(self, bundle: str) -> None:
+        """
+        Remove every index entry served from bundle (a rare event, so a
+        scan of the index is fine).
+        """
+        prefix = bundle + MEMBER_SEP
+        self._members.pop(bundle, None)
+        for d in self.idx.dates():
+            for h, path in list(self.idx.hour_paths(d).items()):
+                if path.startswith(prefix):
+                    self.idx.remove(d, h)
+                    if self.cache is not None:
+                        self.cache.invalidate(path)
+
+    def _landed(self, name: str) -> int:
+        path = os.path.join(self.folder, name)
+        if is_bundle_name(name):
+            # (re)written bundle: replace whatever it provided before
+            self._drop_bundle(path)
+            self._members[path] = _add_bundle(self.idx, path)
+            self._names.add(name)
+            return 1
+        key = match_chunk_name(name)
+        if key is None:
+            return 0
+        self._names.add(name)
+        if not _add_chunk(self.idx, key[0], key[1], path):
+            return 0  # e.g. a .txt.gz next to the plain .txt for that hour
+        if self.cache is not None:
+            self.cache.invalidate(path)
+        return 1
+
+    def _removed(self, name: str) -> int:
+        if name not in self._names:
+            return 0
+        self._names.discard(name)
+        path = os.path.join(self.folder, name)
+        if is_bundle_name(name):
+            self._drop_bundle(path)
+            return 1
+        key = match_chunk_name(name)
+        if key is None:
+            return 0
+        if self.idx.hour_paths(key[0]).get(key[1]) != path:
+            return 0  # a file of higher precedence holds the hour
+        self.idx.remove(key[0], key[1])
+        if self.cache is not None:
+            self.cache.invalidate(path)
+        # the .txt.gz (or plain .txt) twin may still hold this hour
+        plain = CHUNK_TEMPLATE.format(date=key[0], hour=key[1])
+        for other in (plain, plain + ".gz"):
+            if other != name and other in self._names:
+                self.idx.add(key[0], key[1], os.path.join(self.folder, other))
+                return 1
+        # a bundle may still hold this hour (e.g. the file was just archived)
+        for bundle in sorted(os.path.join(self.folder, n) for n in self._names if is_bundle_name(n)):
+            for member in self._bundle_members(bundle):
+                if match_chunk_name(os.path.basename(member)) == key:
+                    self.idx.add(key[0], key[1], bundle + MEMBER_SEP + member)
+                    return 1
+        return 1
+
+
+def watch(watcher: ChunkWatcher, interval: float = 5.0, stop: Optional[threading.Event] = None,
+          on_change: Optional[Callable[[int], None]] = None) -> None:
+    """
+    Run watcher.poll() until `stop` is set: blocks on the inotify fd, or
+    sleeps `interval` seconds between polls. on_change(n) runs after each
+    batch of n changes.
+    """
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        fd = watcher.fileno()
+        if fd is not None:
+            select.select([fd], [], [], interval)
+        else:
+            stop.wait(interval)
+        n = watcher.poll()
+        if n and on_change is not None:
+            on_change(n)
+
+
+# ---------- Bulk extraction ----------
+
+def _parse_batch(batch: List[Tuple[str, int, str]], keys: Optional[Tuple[str, ...]]) -> List[Tuple[str, int, tuple]]:
+    """
+    bulk_extract worker: parse a batch of files in a child process and
+    return compact (date_str, hour, values) rows, values aligned to keys
+    (None for a missing field), or (raw,) if no keys.
+    """
+    wanted = frozenset(keys) if keys else RAW_ONLY
+    rows = []
+    for date_str, h, path in batch:
+        data = parse_chunk_text(read_file(path), wanted)
+        if keys:
+            rows.append((date_str, h, tuple(data.get(k) for k in keys)))
+        else:
+            rows.append((date_str, h, (data["raw"],)))
+    return rows
+
+
+def bulk_extract(idx: ChunkIndex, fields: Optional[List[str]] = None, processes: Optional[int] = None,
+                 batch_size: int = 512) -> Iterator[Tuple[str, int, Dict[str, str]]]:
+    """
+    Parse every indexed chunk on a process pool and stream
+    (date_str, hour, row) in chronological order, rows shaped like query_day.
+    Files are sharded into batches of `batch_size` so per-task overhead stays
+    small; parsing is CPU bound, so processes (not threads) give the speedup.
+    """
+    keys = normalize_fields(fields)
+    key_tuple = tuple(keys) if keys else None
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    def batches() -> Iterator[List[Tuple[str, int, str]]]:
+        batch: List[Tuple[str, int, str]] = []
+        for d in sorted(idx.by_date):
+            by_hour = idx.by_date[d]
+            for h in sorted(by_hour):
+                batch.append((d, h, by_hour[h]))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    worker = partial(_parse_batch, keys=key_tuple)
+    for rows in _ordered_map(worker, batches(), processes, window=processes * 2,
+                             executor=ProcessPoolExecutor):
+        for date_str, h, values in rows:
+            if key_tuple:
+                yield date_str, h, {k: v for k, v in zip(key_tuple, values) if v is not None}
+            else:
+                yield date_str, h, {"raw": values[0]}
+
+
+# ---------- Numeric values ----------
+
+NUMBER = r"-?\d+(?:\.\d+)?"
+STAT_RE = re.compile(rf"\b(median|max|min)\s+({NUMBER})", re.I)
+RANGE_RE = re.compile(rf"({NUMBER})\s*[–—-]\s*({NUMBER})")
+NUMBER_RE = re.compile(NUMBER)
+LABEL_RE = re.compile(r"\(([^()]*)\)\s*$")
+
+# numeric columns stored per field; see parse_measurement
+NUMERIC_STATS = ("value", "min", "max")
+
+
+def parse_measurement(text: str) -> Dict[str, Any]:
+    """
+    Turn a field value string into numbers:
+      'median 27.4°C, max 27.4°C, min 27.3°C' -> value 27.4, max 27.4, min 27.3
+      '428–438 ppm (optimal)'                -> value 433.0, min 428, max 438, label 'optimal'
+      '4.7 µg/m³ (good)'                      -> value 4.7, label 'good'
+    'value' is the median, else the midpoint of a range, else the first number.
+    Keys that can't be found are left out.
+    """
+    out: Dict[str, Any] = {}
+    for name, num in STAT_RE.findall(text):
+        out.setdefault(name.lower(), float(num))
+    if "median" in out:
+        out["value"] = out.pop("median")
+    else:
+        m = RANGE_RE.search(text)
+        if m:
+            low, high = float(m.group(1)), float(m.group(2))
+            out.setdefault("min", low)
+            out.setdefault("max", high)
+            out["value"] = (low + high) / 2
+        else:
+            m = NUMBER_RE.search(text)
+            if m:
+                out["value"] = float(m.group())
+    m = LABEL_RE.search(text)
+    if m:
+        out["label"] = m.group(1).strip().lower()
+    return out
+
+
+# ---------- Columnar store ----------
+
+def _float_column(n: int) -> Any:
+    if np is not None:
+        return np.full(n, np.nan)
+    return array("d", [math.nan]) * n
+
+
+def _code_column(n: int) -> Any:
+    if np is not None:
+        return np.full(n, -1, dtype=np.int16)
+    return array("h", [-1]) * n
+
+
+@dataclass
+class ColumnStore:
+    """
+    Typed per-field columns indexed by hour offset from `start` 00:00.
+    columns["co2.value"], ["co2.min"], ["co2.max"] are float arrays (NaN =
+    missing); columns["co2.label"] holds category codes into labels["co2"]
+    (-1 = missing). Arrays are NumPy when installed, else array.array.
+    """
+    start: date
+    hours: int
+    fields: Tuple[str, ...]
+    columns: Dict[str, Any] = field(default_factory=dict)
+    labels: Dict[str, List[str]] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        for f in self.fields:
+            for stat in NUMERIC_STATS:
+                self.columns.setdefault(f"{f}.{stat}", _float_column(self.hours))
+            self.columns.setdefault(f"{f}.label", _code_column(self.hours))
+            self.labels.setdefault(f, [])
+
+    def offset(self, date_str: str, hour: int) -> int:
+        d = datetime.strptime(date_str, "%Y-%m-%d").date()
+        return (d - self.start).days * 24 + hour
+
+    def at(self, offset: int) -> Tuple[str, int]:
+        d = self.start + timedelta(days=offset // 24)
+        return d.strftime("%Y-%m-%d"), offset % 24
+
+    def column(self, name: str) -> Any:
+        return self.columns[name]
+
+    def label_code(self, field_key: str, label: str) -> int:
+        cats = self.labels[field_key]
+        try:
+            return cats.index(label)
+        except ValueError:
+            cats.append(label)
+            return len(cats) - 1
+
+    def add(self, date_str: str, hour: int, row: Dict[str, str]) -> None:
+        """
+        Store one parsed chunk row (field -> value string).
+        """
+        i = self.offset(date_str, hour)
+        if not 0 <= i < self.hours:
+            raise ValueError(f"{date_str} {hour:02d}:00 is outside the store")
+        for f in self.fields:
+            text = row.get(f)
+            if text is None:
+                continue
+            meas = parse_measurement(text)
+            for stat in NUMERIC_STATS:
+                if stat in meas:
+                    self.columns[f"{f}.{stat}"][i] = meas[stat]
+            if "label" in meas:
+                self.columns[f"{f}.label"][i] = self.label_code(f, meas["label"])
+
+
+def build_column_store(idx: ChunkIndex, fields: Optional[List[str]] = None,
+                       processes: Optional[int] = None) -> ColumnStore:
+    """
+    Parse the whole index (bulk_extract) into a ColumnStore spanning the
+    first to the last indexed day. Default: all six fields.
+    """
+    keys = tuple(normalize_fields(fields) or sorted(ALL_FIELDS))
+    days = sorted(idx.by_date)
+    if not days:
+        return ColumnStore(start=date.today(), hours=0, fields=keys)
+    start = parse_date_string(days[0])
+    end = parse_date_string(days[-1])
+    store = ColumnStore(start=start, hours=((end - start).days + 1) * 24, fields=keys)
+    for date_str, h, row in bulk_extract(idx, list(keys), processes=processes):
+        store.add(date_str, h, row)
+    return store
+
+
+# ---------- Aggregates ----------
+
+AGG_PERIODS = ("day", "week", "month")
+DEFAULT_AGG_STATS = ("count", "mean", "min", "max", "p50", "p95")
+
+
+def _period_bins(start: date, end: date, period: str) -> List[Tuple[str, date, date]]:
+    """
+    (label, first day, last day) of each day/ISO week/month touching start..end,
+    clipped to that range.
+    """
+    bins: List[Tuple[str, date, date]] = []
+    d = start
+    while d <= end:
+        if period == "day":
+            label, nxt = d.isoformat(), d + timedelta(days=1)
+        elif period == "week":
+            iso = d.isocalendar()
+            label, nxt = f"{iso[0]}-W{iso[1]:02d}", d + timedelta(days=7 - d.weekday())
+        elif period == "month":
+            label = d.strftime("%Y-%m")
+            nxt = date(d.year + d.month // 12, d.month % 12 + 1, 1)
+        else:
+            raise ValueError(f"Unknown period: {period} (use {', '.join(AGG_PERIODS)})")
+        last = min(nxt - timedelta(days=1), end)
+        bins.append((label, d, last))
+        d = nxt
+    return bins
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    """
+    Linear-interpolated percentile (NumPy's default method) of sorted values.
+    """
+    pos = (len(sorted_vals) - 1) * q / 100
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (pos - lo)
+
+
+def _stat_percent(stat: str) -> float:
+    if not re.fullmatch(r"p\d{1,2}(?:\.\d+)?|p100", stat):
+        raise ValueError(f"Unknown statistic: {stat}")
+    return float(stat[1:])
+
+
+def aggregate(store: ColumnStore, field_name: str, period: str = "day",
+              stats: Tuple[str, ...] = DEFAULT_AGG_STATS, start: Optional[DateLike] = None,
+              end: Optional[DateLike] = None, column: str = "value") -> List[Tuple[str, Dict[str, float]]]:
+    """
+    Per day/week/month statistics of one field column, e.g. weekly p95 CO2:
+        aggregate(store, "co2", "week", ("p95",), "2025-01-01", "2025-12-31")
+    stats: count, mean, min, max and pNN percentiles. Hours without data are
+    ignored; a period with no data gets count 0 and NaN for the rest.
+    With NumPy, every period is a row of one padded matrix and each statistic
+    is a single reduction over it.
+    """
+    key = normalize_field_name(field_name)
+    if key not in store.fields:
+        raise ValueError(f"Field not in store: {field_name}")
+    for stat in stats:
+        if stat not in ("count", "mean", "min", "max"):
+            _stat_percent(stat)
+    col = store.column(f"{key}.{column}")
+    last_day = store.start + timedelta(days=store.hours // 24 - 1)
+    first = max(_as_date(start), store.start) if start is not None else store.start
+    last = min(_as_date(end), last_day) if end is not None else last_day
+    if store.hours == 0 or first > last:
+        return []
+    bins = _period_bins(first, last, period)
+    bounds = [((a - store.start).days * 24, ((b - store.start).days + 1) * 24) for _, a, b in bins]
+
+    if np is not None:
+        width = max(hi - lo for lo, hi in bounds)
+        lo = np.array([b[0] for b in bounds])[:, None]
+        hi = np.array([b[1] for b in bounds])[:, None]
+        pos = lo + np.arange(width)[None, :]
+        padded = np.append(np.asarray(col, dtype=float), np.nan)
+        matrix = padded[np.where(pos < hi, pos, len(padded) - 1)]
+        results: Dict[str, Any] = {}
+        with warnings.catch_warnings(), np.errstate(all="ignore"):
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for stat in stats:
+                if stat == "count":
+                    results[stat] = (~np.isnan(matrix)).sum(axis=1)
+                elif stat == "mean":
+                    results[stat] = np.nanmean(matrix, axis=1)
+                elif stat == "min":
+                    results[stat] = np.nanmin(matrix, axis=1)
+                elif stat == "max":
+                    results[stat] = np.nanmax(matrix, axis=1)
+                else:
+                    results[stat] = np.nanpercentile(matrix, _stat_percent(stat), axis=1)
+        return [(label, {stat: float(results[stat][i]) for stat in stats})
+                for i, (label, _, _) in enumerate(bins)]
+
+    out: List[Tuple[str, Dict[str, float]]] = []
+    for (label, _, _), (lo, hi) in zip(bins, bounds):
+        vals = sorted(v for v in col[lo:hi] if not math.isnan(v))
+        row: Dict[str, float] = {}
+        for stat in stats:
+            if stat == "count":
+                row[stat] = float(len(vals))
+            elif not vals:
+                row[stat] = math.nan
+            elif stat == "mean":
+                row[stat] = math.fsum(vals) / len(vals)
+            elif stat == "min":
+                row[stat] = vals[0]
+            elif stat == "max":
+                row[stat] = vals[-1]
+            else:
+                row[stat] = _percentile(vals, _stat_percent(stat))
+        out.append((label, row))
+    return out
+
+
+def format_aggregate_output(rows: List[Tuple[str, Dict[str, float]]], stats: Tuple[str, ...],
+                            approx: bool = False) -> str:
+    """
+    Table of aggregate() rows; approx=True (rollup tiers) adds a note that
+    the percentiles are sketch estimates.
+    """
+    lines: List[str] = ["period      " + "".join(f"{s:>10}" for s in stats)]
+    for label, row in rows:
+        cells = []
+        for s in stats:
+            v = row[s]
+            cells.append(f"{int(v):>10d}" if s == "count" else ("       n/a" if math.isnan(v) else f"{v:>10.2f}"))
+        lines.append(f"{label:<12}" + "".join(cells))
+    if approx and any(s not in ("count", "mean", "min", "max") for s in stats):
+        lines.append("(percentiles are quantile-sketch estimates, exact up to ~200 hours per period; "
+                     "use exact mode for exact values)")
+    return "\n".join(lines)
+
+
+# ---------- Columnar export ----------
+
+EXPORT_MANIFEST = "_manifest.json"
+
+
+def _month_indexes(idx: ChunkIndex) -> Dict[str, ChunkIndex]:
+    """
+    Split an index into one ChunkIndex per 'YYYY-MM', in date order.
+    """
+    months: Dict[str, ChunkIndex] = {}
+    for d in idx.dates():
+        months.setdefault(d[:7], ChunkIndex()).by_date[d] = dict(idx.hour_paths(d))
+    return months
+
+
+def _chunks_fingerprint(idx: ChunkIndex, dates: Optional[List[str]] = None) -> str:
+    """
+    Hash of every chunk's path and (mtime, size) on `dates` (default: all):
+    changes when a chunk is added, removed or rewritten.
+    """
+    h = hashlib.sha1()
+    for d in idx.dates() if dates is None else dates:
+        for hour, path in sorted(idx.hour_paths(d).items()):
+            mtime_ns, size = file_stamp(path)
+            h.update(f"{d} {hour} {path} {mtime_ns} {size}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _export_columns(keys: Tuple[str, ...]) -> List[str]:
+    cols = ["date", "hour"]
+    for k in keys:
+        cols += [f"{k}_{stat}" for stat in NUMERIC_STATS] + [f"{k}_label"]
+    return cols
+
+
+def _export_month(month_idx: ChunkIndex, keys: Tuple[str, ...], path: str, fmt: str,
+                  batch_size: int, processes: Optional[int]) -> int:
+    """
+    Parse one month (in batches, see bulk_extract) and write it as one
+    typed columnar file; returns the row count.
+    """
+    columns: Dict[str, List[Any]] = {c: [] for c in _export_columns(keys)}
+    for date_str, h, row in bulk_extract(month_idx, list(keys), processes, batch_size):
+        columns["date"].append(date_str)
+        columns["hour"].append(h)
+        for k in keys:
+            meas = parse_measurement(row[k]) if k in row else {}
+            for stat in NUMERIC_STATS:
+                columns[f"{k}_{stat}"].append(meas.get(stat))
+            columns[f"{k}_label"].append(meas.get("label"))
+    tmp = path + ".tmp"
+    if fmt == "parquet":
+        types = {"date": pyarrow.string(), "hour": pyarrow.int8()}
+        for c in columns:
+            types.setdefault(c, pyarrow.string() if c.endswith("_label") else pyarrow.float64())
+        table = pyarrow.table({c: pyarrow.array(v, type=types[c]) for c, v in columns.items()})
+        pyarrow.parquet.write_table(table, tmp)
+    else:
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(columns)
+            w.writerows(zip(*columns.values()))
+    os.replace(tmp, path)
+    return len(columns["date"])
+
+
+def export_columnar(idx: ChunkIndex, out_dir: str, fields: Optional[List[str]] = None, fmt: str = "auto",
+                    batch_size: int = 512, processes: Optional[int] = 1) -> Dict[str, Any]:
+    """
+    Export the archive as one columnar file per month:
+        out_dir/month=YYYY-MM/part-0.parquet   (or part-0.csv)
+    Columns: date, hour, and per field <field>_value/_min/_max (float) and
+    <field>_label (string). fmt 'auto' picks Parquet when pyarrow is
+    installed, else CSV. A manifest of per-month fingerprints makes re-runs
+    incremental: only months with new, removed or changed chunks are
+    rewritten, and months gone from the index are deleted.
+    """
+    if fmt == "auto":
+        fmt = "parquet" if pyarrow is not None else "csv"
+    if fmt == "parquet" and pyarrow is None:
+        raise RuntimeError("pyarrow is required for Parquet export")
+    if fmt not in ("parquet", "csv"):
+        raise ValueError(f"Unknown export format: {fmt}")
+    keys = tuple(normalize_fields(fields) or sorted(ALL_FIELDS))
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, EXPORT_MANIFEST)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    # a different column set or format invalidates every partition
+    settings = {"format": fmt, "fields": list(keys)}
+    previous: Dict[str, str] = manifest.get("months", {})
+    old_months = previous
+    if manifest.get("settings") != settings:
+        # drop every old partition up front, so an interrupted re-export
+        # can't leave files with the old schema behind
+        for name in os.listdir(out_dir):
+            if name.startswith("month="):
+                shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+        old_months = {}
+
+    months = _month_indexes(idx)
+    written: List[str] = []
+    rows = 0
+    new_months: Dict[str, str] = {}
+    for month, month_idx in months.items():
+        fp = _chunks_fingerprint(month_idx)
+        new_months[month] = fp
+        part_dir = os.path.join(out_dir, f"month={month}")
+        part = os.path.join(part_dir, f"part-0.{fmt}")
+        if old_months.get(month) == fp and os.path.exists(part):
+            continue
+        if os.path.isdir(part_dir):
+            shutil.rmtree(part_dir)
+        os.makedirs(part_dir)
+        rows += _export_month(month_idx, keys, part, fmt, batch_size, processes)
+        written.append(month)
+        # save progress so an interrupted export resumes where it stopped
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "months": {**old_months, **new_months}}, f)
+    # whatever the settings, months gone from the index must not stay on disk
+    removed = [m for m in previous if m not in months]
+    for month in removed:
+        shutil.rmtree(os.path.join(out_dir, f"month={month}"), ignore_errors=True)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"settings": settings, "months": new_months}, f)
+    return {
+        "format": fmt,
+        "written": written,
+        "unchanged": [m for m in months if m not in written],
+        "removed": removed,
+        "rows": rows,
+    }
+
+
+# ---------- Quantile sketch ----------
+
+class QuantileSketch:
+    """
+    Mergeable KLL-style quantile sketch. Values go into level 0; a level
+    over its capacity is sorted and every other item (alternating offset)
+    moves up a level with twice the weight. Capacities shrink by 2/3 per
+    level below the top, so the sketch keeps O(k) values however many it
+    has seen; rank error is about 1.7/k (under 1% at the default k=200).
+    Exact (interpolated like _percentile) until the first compaction.
+    """
+
+    def __init__(self, k: int = 200) -> None:
+        self.k = k
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels: List[List[float]] = [[]]
+        self._flips: List[bool] = [False]
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - 1 - level
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            buf = self.levels[level]
+            if len(buf) >= self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                    self._flips.append(False)
+                buf.sort()
+                # per-level alternating offset: successive compactions of a
+                # level promote the lower and the upper item of each pair in turn
+                flip = self._flips[level] = not self._flips[level]
+                keep = [buf.pop()] if len(buf) % 2 else []
+                self.levels[level + 1].extend(buf[flip::2])
+                self.levels[level] = keep
+            level += 1
+
+    def add(self, value: float) -> None:
+        self.levels[0].append(value)
+        self.n += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """
+        Fold `other` into this sketch (other is left unchanged); returns self.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+            self._flips.append(False)
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    @property
+    def rank_error(self) -> float:
+        """
+        Expected bound on the rank error of quantile() as a fraction of n:
+        0 while the sketch is exact.
+        """
+        return 0.0 if len(self.levels) == 1 else 2.0 / self.k
+
+    def quantile(self, q: float) -> float:
+        """
+        Approximate value at quantile q (0..1); NaN when empty.
+        """
+        if self.n == 0:
+            return math.nan
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        if len(self.levels) == 1:
+            return _percentile(sorted(self.levels[0]), q * 100)
+        weighted = sorted((v, 1 << level) for level, items in enumerate(self.levels) for v in items)
+        target = q * self.n
+        seen = 0
+        for v, w in weighted:
+            seen += w
+            if seen >= target:
+                return v
+        return self.max
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"k": self.k, "n": self.n, "min": self.min if self.n else None,
+                "max": self.max if self.n else None, "levels": self.levels}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "QuantileSketch":
+        sketch = cls(data["k"])
+        sketch.n = data["n"]
+        if sketch.n:
+            sketch.min, sketch.max = data["min"], data["max"]
+        sketch.levels = [list(items) for items in data["levels"]] or [[]]
+        sketch._flips = [False] * len(sketch.levels)
+        return sketch
+
+
+# ---------- Rollup tiers ----------
+
+ROLLUP_FILENAME = ".rollups.json"
+ROLLUP_VERSION = 1
+
+
+def _day_changes(idx: ChunkIndex, day_fps: Dict[str, str]) -> Tuple[Dict[str, str], List[str], List[str]]:
+    """
+    Per-day chunk fingerprints of the index, and against the stored ones
+    (day_fps) the days that are new or changed and the days that are gone.
+    """
+    fps = {d: _chunks_fingerprint(idx, [d]) for d in idx.dates()}
+    changed = [d for d, fp in fps.items() if day_fps.get(d) != fp]
+    removed = [d for d in day_fps if d not in fps]
+    return fps, changed, removed
+
+
+def _load_sidecar(path: str, version: int, from_json: Callable[[Dict[str, Any]], Any]) -> Any:
+    """
+    from_json(data) of a JSON sidecar, or None if it is missing, unreadable
+    or from another version.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == version:
+            return from_json(data)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _save_sidecar(path: str, obj: Any, changes: Dict[str, int]) -> None:
+    """
+    Write obj.to_json() if update() reported changed or removed days, or
+    the sidecar doesn't exist yet.
+    """
+    if changes["days"] or changes["removed"] or not os.path.exists(path):
+        try:
+            # in place, like save_index: replacing would bump the folder mtime
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(obj.to_json(), f, separators=(",", ":"))
+        except OSError:
+            pass
+
+
+@dataclass
+class FieldSummary:
+    """
+    count/sum/min/max and a quantile sketch of one field's hourly values.
+    """
+    count: int = 0
+    total: float = 0.0
+    sketch: QuantileSketch = field(default_factory=QuantileSketch)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.sketch.add(value)
+
+    def merge(self, other: "FieldSummary") -> "FieldSummary":
+        self.count += other.count
+        self.total += other.total
+        self.sketch.merge(other.sketch)
+        return self
+
+    def stats(self, stats: Tuple[str, ...] = DEFAULT_AGG_STATS) -> Dict[str, float]:
+        """
+        The same statistics as aggregate(); percentiles come from the sketch.
+        """
+        row: Dict[str, float] = {}
+        for stat in stats:
+            if stat == "count":
+                row[stat] = float(self.count)
+            elif not self.count:
+                row[stat] = math.nan
+            elif stat == "mean":
+                row[stat] = self.total / self.count
+            elif stat == "min":
+                row[stat] = self.sketch.min
+            elif stat == "max":
+                row[stat] = self.sketch.max
+            else:
+                row[stat] = self.sketch.quantile(_stat_percent(stat) / 100)
+        return row
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"count": self.count, "sum": self.total, "sketch": self.sketch.to_json()}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "FieldSummary":
+        return cls(data["count"], data["sum"], QuantileSketch.from_json(data["sketch"]))
+
+
+class Rollups:
+    """
+    Day and month summary tiers (FieldSummary per numeric field) over one
+    chunk folder. Each day keeps the fingerprint of its chunks, so update()
+    only re-parses days whose files changed and re-merges their months.
+    Range queries merge whole months from the month tier and only the
+    partial months at the edges from the day tier.
+    """
+
+    def __init__(self, fields: Optional[List[str]] = None) -> None:
+        self.fields: List[str] = normalize_fields(fields) or sorted(ALL_FIELDS)
+        self.day_fps: Dict[str, str] = {}
+        self.days: Dict[str, Dict[str, FieldSummary]] = {}
+        self.months: Dict[str, Dict[str, FieldSummary]] = {}
+
+    def update(self, idx: ChunkIndex, processes: Optional[int] = 1) -> Dict[str, int]:
+        fps, changed, removed = _day_changes(idx, self.day_fps)
+        todo = ChunkIndex({d: dict(idx.hour_paths(d)) for d in changed})
+        fresh = {d: {k: FieldSummary() for k in self.fields} for d in changed}
+        for d, _, row in bulk_extract(todo, self.fields, processes):
+            for k, text in row.items():
+                value = parse_measurement(text).get("value")
+                if value is not None:
+                    fresh[d][k].add(value)
+        for d in removed:
+            del self.days[d]
+            del self.day_fps[d]
+        for d in changed:
+            self.days[d] = fresh[d]
+            self.day_fps[d] = fps[d]
+
+        months = sorted({d[:7] for d in changed + removed})
+        for m in months:
+            summary = {k: FieldSummary() for k in self.fields}
+            for d in sorted(self.days):
+                if d.startswith(m):
+                    for k in self.fields:
+                        summary[k].merge(self.days[d][k])
+            if any(s.count for s in summary.values()) or any(d.startswith(m) for d in self.days):
+                self.months[m] = summary
+            else:
+                self.months.pop(m, None)
+        return {"days": len(changed), "removed": len(removed), "months": len(months)}
+
+    def summary(self, field_name: str, start: DateLike, end: DateLike) -> FieldSummary:
+        """
+        Merged summary of one field over start..end (inclusive), using the
+        month tier for every whole month in the range.
+        """
+        key = normalize_field_name(field_name)
+        if key not in self.fields:
+            raise ValueError(f"Field not in rollups: {field_name}")
+        out = FieldSummary()
+        d, last = _as_date(start), _as_date(end)
+        while d <= last:
+            nxt_month = date(d.year + d.month // 12, d.month % 12 + 1, 1)
+            month = self.months.get(d.strftime("%Y-%m"))
+            if d.day == 1 and nxt_month - timedelta(days=1) <= last and month is not None:
+                out.merge(month[key])
+                d = nxt_month
+                continue
+            day = self.days.get(d.isoformat())
+            if day is not None:
+                out.merge(day[key])
+            d += timedelta(days=1)
+        return out
+
+    def aggregate(self, field_name: str, period: str = "month", stats: Tuple[str, ...] = DEFAULT_AGG_STATS,
+                  start: Optional[DateLike] = None, end: Optional[DateLike] = None) -> List[Tuple[str, Dict[str, float]]]:
+        """
+        Like aggregate() on a ColumnStore, but from the tiers: no chunk is
+        read. Percentiles are sketch estimates.
+        """
+        for stat in stats:
+            if stat not in ("count", "mean", "min", "max"):
+                _stat_percent(stat)
+        if not self.days:
+            return []
+        first = _as_date(start) if start is not None else parse_date_string(min(self.days))
+        last = _as_date(end) if end is not None else parse_date_string(max(self.days))
+        if first > last:
+            return []
+        return [(label, self.summary(field_name, a, b).stats(stats))
+                for label, a, b in _period_bins(first, last, period)]
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "version": ROLLUP_VERSION,
+            "fields": self.fields,
+            "days": {d: {"fp": self.day_fps[d], "fields": {k: s.to_json() for k, s in by_field.items()}}
+                     for d, by_field in self.days.items()},
+            "months": {m: {k: s.to_json() for k, s in by_field.items()} for m, by_field in self.months.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Rollups":
+        r = cls(data["fields"])
+        for d, entry in data["days"].items():
+            r.day_fps[d] = entry["fp"]
+            r.days[d] = {k: FieldSummary.from_json(v) for k, v in entry["fields"].items()}
+        for m, by_field in data["months"].items():
+            r.months[m] = {k: FieldSummary.from_json(v) for k, v in by_field.items()}
+        return r
+
+
+def load_rollups(path: str, fields: Optional[List[str]] = None) -> Rollups:
+    """
+    Rollups from a sidecar file, or empty ones if it is missing, unreadable,
+    from another version or for other fields.
+    """
+    wanted = normalize_fields(fields) or sorted(ALL_FIELDS)
+    rollups = _load_sidecar(path, ROLLUP_VERSION, Rollups.from_json)
+    return rollups if rollups is not None and rollups.fields == wanted else Rollups(wanted)
+
+
+def build_rollups(idx: ChunkIndex, folder: str, path: Optional[str] = None,
+                  fields: Optional[List[str]] = None, processes: Optional[int] = 1) -> Rollups:
+    """
+    Load the rollup sidecar next to the chunks (.rollups.json), bring it up
+    to date with the index and save it back if anything changed.
+    """
+    if path is None:
+        path = os.path.join(folder, ROLLUP_FILENAME)
+    rollups = load_rollups(path, fields)
+    _save_sidecar(path, rollups, rollups.update(idx, processes))
+    return rollups
+
+
+DEFAULT_QUANTILES = (50.0, 95.0, 99.0)
+SiteRollups = Dict[str, Rollups]
+
+
+def site_rollups(sites: SiteIndex, rollup_dir: Optional[str] = None, fields: Optional[List[str]] = None,
+                 processes: Optional[int] = 1) -> SiteRollups:
+    """
+    Rollups for every site of index_sites(). With rollup_dir they persist
+    as <rollup_dir>/<site>.rollups.json and only changed days are parsed
+    again; without it they are built in memory.
+    """
+    out: SiteRollups = {}
+    for name in sorted(sites):
+        if rollup_dir is None:
+            out[name] = Rollups(fields)
+            out[name].update(sites[name], processes)
+        else:
+            os.makedirs(rollup_dir, exist_ok=True)
+            path = os.path.join(rollup_dir, f"{name}{ROLLUP_FILENAME}")
+            out[name] = build_rollups(sites[name], rollup_dir, path, fields, processes)
+    return out
+
+
+def range_quantiles(rollups: Union[Rollups, SiteRollups], field_name: str, start: Optional[DateLike] = None,
+                    end: Optional[DateLike] = None, qs: Iterable[float] = DEFAULT_QUANTILES,
+                    site: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Percentiles (qs in 0..100) of one field over start..end, merged from
+    per-day/month sketches of one Rollups or of every site in a
+    SiteRollups (or just `site`). Memory is O(k) however long the range;
+    'rank_error' is the bound on how far each estimate's rank may be off.
+    """
+    if isinstance(rollups, Rollups):
+        targets = [rollups]
+    elif site is not None:
+        if site not in rollups:
+            raise KeyError(f"Unknown site: {site}")
+        targets = [rollups[site]]
+    else:
+        targets = [rollups[name] for name in sorted(rollups)]
+    days = [d for r in targets for d in r.days]
+    if not days:
+        first = last = None
+    else:
+        first = _as_date(start) if start is not None else parse_date_string(min(days))
+        last = _as_date(end) if end is not None else parse_date_string(max(days))
+    merged = FieldSummary()
+    if first is not None and first <= last:
+        for r in targets:
+            merged.merge(r.summary(field_name, first, last))
+    out: Dict[str, Any] = {
+        "field": normalize_field_name(field_name),
+        "from": first.isoformat() if first else None,
+        "to": last.isoformat() if last else None,
+        "count": merged.count,
+    }
+    for q in qs:
+        if not 0 <= q <= 100:
+            raise ValueError(f"Quantile out of range: {q}")
+        out[f"p{q:g}"] = merged.sketch.quantile(q / 100) if merged.count else None
+    out["rank_error"] = merged.sketch.rank_error
+    return out
+
+
+# ---------- SQLite store ----------
+
+SQLITE_FIELDS = tuple(sorted(ALL_FIELDS))
+SQLITE_PROJECTABLE = frozenset(SQLITE_FIELDS) | RAW_ONLY
+FILTER_OPS = ("<=", ">=", "!=", "=", "<", ">")
+FILTER_RE = re.compile(r"^\s*(.+?)\s*(<=|>=|!=|=|<|>)\s*(-?\d+(?:\.\d+)?)\s*%?\s*$")
+
+
+def _sqlite_columns() -> List[Tuple[str, str]]:
+    cols = [("site", "TEXT NOT NULL"), ("date", "TEXT NOT NULL"), ("hour", "INTEGER NOT NULL"),
+            ("path", "TEXT NOT NULL"), ("mtime_ns", "INTEGER"), ("size", "INTEGER"), ("raw", "TEXT")]
+    for f in SQLITE_FIELDS:
+        cols += [(f, "TEXT"), (f"{f}_value", "REAL"), (f"{f}_min", "REAL"), (f"{f}_max", "REAL"), (f"{f}_label", "TEXT")]
+    return cols
+
+
+SQLITE_COLUMNS = _sqlite_columns()
+
+
+def _store_rows(batch: List[Tuple[str, str, int, str, int, int]]) -> List[tuple]:
+    """
+    SqliteStore.ingest worker: parse a batch of chunks into table rows
+    (module level so it can run on a process pool).
+    """
+    rows = []
+    for site, date_str, h, path, mtime_ns, size in batch:
+        data = parse_chunk_text(read_file(path))
+        row: List[Any] = [site, date_str, h, path, mtime_ns, size, data["raw"]]
+        for f in SQLITE_FIELDS:
+            text = data.get(f)
+            meas = parse_measurement(text) if text is not None else {}
+            row += [text, meas.get("value"), meas.get("min"), meas.get("max"), meas.get("label")]
+        rows.append(tuple(row))
+    return rows
+
+
+def parse_filter(expr: str) -> List[Tuple[str, str, float]]:
+    """
+    'co2>1000, humidity>60%' -> [('co2', '>', 1000.0), ('humidity', '>', 60.0)].
+    Conditions are separated by commas or 'and'; fields go through
+    normalize_field_name and only the six known fields and FILTER_OPS are accepted.
+    """
+    out: List[Tuple[str, str, float]] = []
+    for part in re.split(r",|\band\b", expr, flags=re.I):
+        if not part.strip():
+            continue
+        m = FILTER_RE.match(part)
+        if not m:
+            raise ValueError(f"Bad filter condition: {part.strip()!r} (expected e.g. 'co2>1000')")
+        key = normalize_field_name(m.group(1))
+        if key not in ALL_FIELDS:
+            raise ValueError(f"Unknown field in filter: {m.group(1)!r}")
+        out.append((key, m.group(2), float(m.group(3))))
+    if not out:
+        raise ValueError("Empty filter")
+    return out
+
+
+class SqliteStore:
+    """
+    Parsed chunks in a local SQLite database, one row per (site, date, hour):
+    the raw text, every field's text and its parsed value/min/max/label.
+    An alternative backend to ChunkIndex + files for ad-hoc numeric filters;
+    query_day/query_hours return the same shapes as the module functions.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        cols = ", ".join(f"{name} {typ}" for name, typ in SQLITE_COLUMNS)
+        with self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS chunks ({cols}, "
+                              "PRIMARY KEY (site, date, hour)) WITHOUT ROWID")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_date ON chunks (date, hour)")
+            for f in SQLITE_FIELDS:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS chunks_{f} ON chunks ({f}_value)")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "SqliteStore":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def sites(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self.conn.execute("SELECT DISTINCT site FROM chunks ORDER BY site")]
+
+    def ingest(self, idx: ChunkIndex, site: str, processes: int = 1, batch_size: int = 512) -> Dict[str, int]:
+        """
+        Load one site's chunks. Incremental: hours whose file (path, mtime,
+        size) is unchanged are skipped, hours gone from the index are
+        deleted. Rows are written with executemany, one transaction per batch.
+        """
+        with self._lock:
+            stored = {(d, h): (path, m, sz) for d, h, path, m, sz in self.conn.execute(
+                "SELECT date, hour, path, mtime_ns, size FROM chunks WHERE site = ?", (site,))}
+        todo: List[Tuple[str, str, int, str, int, int]] = []
+        unchanged = 0
+        for d in idx.dates():
+            for h, path in sorted(idx.hour_paths(d).items()):
+                mtime_ns, size = file_stamp(path)
+                if stored.pop((d, h), None) == (path, mtime_ns, size):
+                    unchanged += 1
+                    continue
+                todo.append((site, d, h, path, mtime_ns, size))
+
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+        insert = (f"INSERT OR REPLACE INTO chunks ({', '.join(n for n, _ in SQLITE_COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * len(SQLITE_COLUMNS))})")
+        for rows in _ordered_map(_store_rows, batches, processes, window=processes * 2,
+                                 executor=ProcessPoolExecutor):
+            with self._lock, self.conn:
+                self.conn.executemany(insert, rows)
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM chunks WHERE site = ? AND date = ? AND hour = ?",
+                                  [(site, d, h) for d, h in stored])
+        return {"ingested": len(todo), "unchanged": unchanged, "removed": len(stored)}
+
+    def ingest_sites(self, sites: SiteIndex, processes: int = 1) -> Dict[str, Dict[str, int]]:
+        return {name: self.ingest(sites[name], name, processes) for name in sorted(sites)}
+
+    def _site(self, site: Optional[str]) -> str:
+        if site is not None:
+            return site
+        names = self.sites()
+        if len(names) > 1:
+            raise ValueError(f"Store has several sites, pick one of: {', '.join(names)}")
+        return names[0] if names else ""
+
+    def _rows(self, sql: str, params: tuple, keys: Optional[List[str]]) -> Iterator[Tuple[str, str, int, Dict[str, str]]]:
+        """
+        Run a query selecting site, date, hour, then the projected columns;
+        rows come back shaped like _project: unknown keys are dropped, and
+        only column names from the allow-list ever reach the SQL text.
+        """
+        cols = [k for k in keys if k in SQLITE_PROJECTABLE] if keys else ["raw"]
+        with self._lock:
+            result = self.conn.execute(sql.format(cols="".join(f", {c}" for c in cols)), params).fetchall()
+        for site, d, h, *values in result:
+            yield site, d, h, {k: v for k, v in zip(cols, values) if v is not None}
+
+    def query_day(self, date_str: str, fields: Optional[List[str]] = None,
+                  site: Optional[str] = None) -> Dict[int, Dict[str, str]]:
+        keys = normalize_fields(fields)
+        sql = "SELECT site, date, hour{cols} FROM chunks WHERE site = ? AND date = ? ORDER BY hour"
+        return {h: row for _, _, h, row in self._rows(sql, (self._site(site), date_str), keys)}
+
+    def query_hours(self, date_str: str, hours: List[int], fields: Optional[List[str]] = None,
+                    site: Optional[str] = None) -> Dict[int, Dict[str, str]]:
+        found = self.query_day(date_str, fields, site)
+        return {h: found.get(h, {"error": "file not found"}) for h in sorted(hours)}
+
+    def where(self, expr: str, start: Optional[DateLike] = None, end: Optional[DateLike] = None,
+              site: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Tuple[str, str, int, Dict[str, str]]]:
+        """
+        Hours matching every condition of a threshold filter (see
+        parse_filter), as (site, date, hour, row) in site/time order.
+        Rows hold `fields`, by default the filtered fields.
+        """
+        conds = parse_filter(expr)
+        keys = normalize_fields(fields) or list(dict.fromkeys(k for k, _, _ in conds))
+        clauses = [f"{k}_value {op} ?" for k, op, _ in conds]
+        params: List[Any] = [v for _, _, v in conds]
+        if site is not None:
+            clauses.append("site = ?")
+            params.append(site)
+        if start is not None:
+            clauses.append("date >= ?")
+            params.append(_as_date(start).isoformat())
+        if end is not None:
+            clauses.append("date <= ?")
+            params.append(_as_date(end).isoformat())
+        sql = ("SELECT site, date, hour{cols} FROM chunks WHERE " + " AND ".join(clauses)
+               + " ORDER BY site, date, hour")
+        return list(self._rows(sql, tuple(params), keys))
+
+
+# ---------- Full-text search ----------
+
+SEARCH_FILENAME = ".search_index.json"
+SEARCH_VERSION = 1
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased words of a text (CO₂ -> co2); pure numbers are skipped.
+    """
+    words = TOKEN_RE.findall(text.lower().replace("₂", "2"))
+    return [w for w in words if not w.isdigit()]
+
+
+def chunk_tokens(text: str) -> set:
+    """
+    Search tokens of one chunk: every word of the raw text, plus a
+    field-qualified token per word of each field's label ('ieq:poor').
+    """
+    data = parse_chunk_text(text)
+    tokens = set(tokenize(data["raw"]))
+    for key in ALL_FIELDS:
+        label = parse_measurement(data[key]).get("label") if key in data else None
+        if label:
+            tokens.update(f"{key}:{w}" for w in tokenize(label))
+    return tokens
+
+
+def _search_batch(batch: List[Tuple[str, int, str]]) -> List[Tuple[str, int, List[str]]]:
+    """
+    SearchIndex.update worker: tokens of a batch of chunks.
+    """
+    return [(d, h, sorted(chunk_tokens(read_file(path)))) for d, h, path in batch]
+
+
+def encode_postings(offsets: Iterable[int], prev: int = 0) -> bytearray:
+    """
+    Sorted hour offsets as varint-encoded gaps (7 bits per byte, high bit
+    = more bytes follow). prev is the last offset already encoded.
+    """
+    out = bytearray()
+    for o in offsets:
+        gap = o - prev
+        prev = o
+        while gap >= 0x80:
+            out.append(gap & 0x7F | 0x80)
+            gap >>= 7
+        out.append(gap)
+    return out
+
+
+def decode_postings(data: bytes) -> List[int]:
+    out: List[int] = []
+    value = shift = prev = 0
+    for b in data:
+        value |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        prev += value
+        out.append(prev)
+        value = shift = 0
+    return out
+
+
+class SearchIndex:
+    """
+    Inverted index over chunk text: token -> sorted hour offsets (as in
+    GapReport) of the chunks containing it, delta + varint compressed.
+    Like Rollups, each day keeps a fingerprint of its files, so update()
+    only tokenizes changed days; hours newer than everything indexed are
+    appended to the postings without decoding them.
+    """
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, bytearray] = {}
+        self.tails: Dict[str, int] = {}  # last offset of each postings list
+        self.day_fps: Dict[str, str] = {}
+
+    def _rebuild(self, drop: set, new: Dict[str, List[int]]) -> None:
+        """
+        Remove every posting on the `drop` day ordinals and merge in `new`.
+        """
+        for token in set(self.postings) | set(new):
+            offsets = [o for o in decode_postings(self.postings.get(token, b"")) if o // 24 not in drop]
+            offsets = sorted(set(offsets).union(new.get(token, ())))
+            if offsets:
+                self.postings[token] = encode_postings(offsets)
+                self.tails[token] = offsets[-1]
+            else:
+                self.postings.pop(token, None)
+                self.tails.pop(token, None)
+
+    def update(self, idx: ChunkIndex, processes: Optional[int] = 1, batch_size: int = 512) -> Dict[str, int]:
+        fps, changed, removed = _day_changes(idx, self.day_fps)
+        todo = [(d, h, path) for d in changed for h, path in sorted(idx.hour_paths(d).items())]
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+        new: Dict[str, List[int]] = {}
+        for rows in _ordered_map(_search_batch, batches, processes, window=processes * 2,
+                                 executor=ProcessPoolExecutor):
+            for d, h, tokens in rows:
+                o = parse_date_string(d).toordinal() * 24 + h
+                for token in tokens:
+                    new.setdefault(token, []).append(o)
+
+        last = max(self.tails.values(), default=-1)
+        fresh_days = not removed and not any(d in self.day_fps for d in changed)
+        if fresh_days and all(offsets[0] > last for offsets in new.values()):
+            # only days never indexed, all newer: extend the compressed lists in place
+            for token, offsets in new.items():
+                self.postings.setdefault(token, bytearray()).extend(
+                    encode_postings(offsets, self.tails.get(token, 0)))
+                self.tails[token] = offsets[-1]
+        elif changed or removed:
+            drop = {parse_date_string(d).toordinal() for d in changed + removed}
+            self._rebuild(drop, new)
+        for d in removed:
+            del self.day_fps[d]
+        for d in changed:
+            self.day_fps[d] = fps[d]
+        return {"days": len(changed), "removed": len(removed), "tokens": len(self.postings)}
+
+    def lookup(self, token: str) -> List[int]:
+        return decode_postings(self.postings.get(token, b""))
+
+    def search(self, query: str, start: Optional[DateLike] = None,
+               end: Optional[DateLike] = None) -> List[Tuple[str, int]]:
+        """
+        (date, hour) of every chunk containing all terms of `query`, in time
+        order. A term is a word ('poor', 'co2') or field:word ('ieq:poor',
+        'PM2.5:good'); multi-word terms must all match.
+        """
+        tokens: List[str] = []
+        for term in query.split():
+            if ":" in term:
+                name, _, word = term.partition(":")
+                tokens.extend(f"{normalize_field_name(name)}:{w}" for w in tokenize(word))
+            else:
+                tokens.extend(tokenize(term))
+        if not tokens:
+            raise ValueError("Empty search query")
+        # intersect starting from the rarest token
+        tokens.sort(key=lambda t: len(self.postings.get(t, b"")))
+        hits = self.lookup(tokens[0])
+        for token in tokens[1:]:
+            if not hits:
+                break
+            other = set(self.lookup(token))
+            hits = [o for o in hits if o in other]
+        lo = _as_date(start).toordinal() * 24 if start is not None else 0
+        hi = (_as_date(end).toordinal() + 1) * 24 if end is not None else math.inf
+        return [(date.fromordinal(o // 24).isoformat(), o % 24) for o in hits if lo <= o < hi]
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "version": SEARCH_VERSION,
+            "days": self.day_fps,
+            "postings": {t: [base64.b64encode(p).decode("ascii"), self.tails[t]] for t, p in self.postings.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "SearchIndex":
+        sidx = cls()
+        sidx.day_fps = dict(data["days"])
+        for token, (b64, tail) in data["postings"].items():
+            sidx.postings[token] = bytearray(base64.b64decode(b64))
+            sidx.tails[token] = tail
+        return sidx
+
+
+def build_search_index(idx: ChunkIndex, folder: str, path: Optional[str] = None,
+                       processes: Optional[int] = 1) -> SearchIndex:
+    """
+    Load the search sidecar (.search_index.json), update it from the index
+    and save it back if anything changed.
+    """
+    if path is None:
+        path = os.path.join(folder, SEARCH_FILENAME)
+    sidx = _load_sidecar(path, SEARCH_VERSION, SearchIndex.from_json)
+    if sidx is None:
+        sidx = SearchIndex()
+    _save_sidecar(path, sidx, sidx.update(idx, processes))
+    return sidx
+
+
+def search_rows(idx: ChunkIndex, sidx: SearchIndex, query: str, start: Optional[DateLike] = None,
+                end: Optional[DateLike] = None, fields: Optional[List[str]] = None,
+                cache: Optional[ParseCache] = None) -> Iterator[Tuple[str, int, Dict[str, str]]]:
+    """
+    Search hits as query rows (date_str, hour, row), shaped like query_range;
+    only the matching chunks are read.
+    """
+    by_day: Dict[str, List[int]] = {}
+    for d, h in sidx.search(query, start, end):
+        by_day.setdefault(d, []).append(h)
+    for d, hours in by_day.items():
+        for h, row in query_hours(idx, d, hours, fields, cache).items():
+            yield d, h, row
+
+
+# ---------- Binary archive ----------
+
+# One file for the whole archive:
+#   header | n_hours fixed-size records (hour offset i from start 00:00) | string heap
+# A record holds the raw text location in the heap, the byte span of each
+# field value inside that raw text, and the NUMERIC_STATS of every field.
+ARCHIVE_MAGIC = b"IOTA"
+ARCHIVE_VERSION = 1
+ARCHIVE_FIELDS = tuple(FIELD_LABELS)
+ARCHIVE_HEADER = struct.Struct("<4sHHiIQ")  # magic, version, n_fields, start ordinal, n_hours, heap offset
+ARCHIVE_RECORD = struct.Struct(
+    "<QIB" + "IH" * len(ARCHIVE_FIELDS) + "d" * (len(ARCHIVE_FIELDS) * len(NUMERIC_STATS))
+)
+HOUR_PRESENT = 0x80  # flags bit; bits 0-5: field i present
+# where the numeric block starts, as unpacked-tuple index and as byte offset
+_NUMERIC_FIRST = 3 + 2 * len(ARCHIVE_FIELDS)
+_NUMERIC_BYTE = struct.calcsize("<QIB" + "IH" * len(ARCHIVE_FIELDS))
+_ABSENT_RECORD = ARCHIVE_RECORD.pack(
+    0, 0, 0, *([0] * 2 * len(ARCHIVE_FIELDS)), *([math.nan] * len(ARCHIVE_FIELDS) * len(NUMERIC_STATS))
+)
+
+
+def _field_spans(raw: str) -> Dict[str, Tuple[int, int]]:
+    """
+    (start, end) character span of each field value in raw, same
+    first-occurrence rule as extract_fields.
+    """
+    spans: Dict[str, Tuple[int, int]] = {}
+    for m in FIELD_LINE_RE.finditer(raw):
+        key = LABEL_PREFIX_KEYS[m.group(1)[:2].lower()]
+        if key not in spans:
+            start = m.start(2)
+            spans[key] = (start, start + len(m.group(2).rstrip()))
+            if len(spans) == len(ARCHIVE_FIELDS):
+                break
+    return spans
+
+
+def _pack_record(raw: str, heap_pos: int) -> Tuple[bytes, bytes]:
+    """
+    Encode one chunk as (record bytes, heap bytes).
+    """
+    raw_b = raw.encode("utf-8")
+    spans = _field_spans(raw)
+    flags = HOUR_PRESENT
+    span_vals: List[int] = []
+    num_vals: List[float] = []
+    for i, key in enumerate(ARCHIVE_FIELDS):
+        if key in spans:
+            a, b = spans[key]
+            start_b = len(raw[:a].encode("utf-8"))
+            length_b = len(raw[a:b].encode("utf-8"))
+            flags |= 1 << i
+            span_vals += [start_b, length_b]
+            meas = parse_measurement(raw[a:b])
+        else:
+            span_vals += [0, 0]
+            meas = {}
+        num_vals += [meas.get(stat, math.nan) for stat in NUMERIC_STATS]
+    rec = ARCHIVE_RECORD.pack(heap_pos, len(raw_b), flags, *span_vals, *num_vals)
+    return rec, raw_b
+
+
+def pack_archive(idx: ChunkIndex, out_path: str, workers: int = 8) -> int:
+    """
+    Convert the indexed chunk files into one binary archive readable by
+    MappedArchive. Returns the number of hours written.
+    """
+    days = sorted(idx.by_date)
+    if not days:
+        raise ValueError("Nothing to pack: index is empty")
+    start = parse_date_string(days[0])
+    n_hours = ((parse_date_string(days[-1]) - start).days + 1) * 24
+    heap_offset = ARCHIVE_HEADER.size + n_hours * ARCHIVE_RECORD.size
+    records = bytearray(_ABSENT_RECORD * n_hours)
+
+    def targets() -> Iterator[Tuple[int, str]]:
+        for d in days:
+            base = (parse_date_string(d) - start).days * 24
+            by_hour = idx.by_date[d]
+            for h in sorted(by_hour):
+                yield base + h, by_hour[h]
+
+    written = 0
+    heap_pos = 0
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, len(ARCHIVE_FIELDS),
+                                    start.toordinal(), n_hours, heap_offset))
+        f.seek(heap_offset)
+        texts = _ordered_map(lambda t: (t[0], read_file(t[1])), targets(), workers, window=workers * 4)
+        for i, text in texts:
+            rec, raw_b = _pack_record(text.strip(), heap_pos)
+            records[i * ARCHIVE_RECORD.size:(i + 1) * ARCHIVE_RECORD.size] = rec
+            f.write(raw_b)
+            heap_pos += len(raw_b)
+            written += 1
+        f.seek(ARCHIVE_HEADER.size)
+        f.write(records)
+    os.replace(tmp_path, out_path)
+    return written
+
+
+class MappedArchive:
+    """
+    Read a pack_archive file through mmap. Records are decoded in place and
+    text is sliced straight out of the mapping, so a long scan touches one
+    file and copies only the strings it returns.
+    query_day/query_hours return the same shapes as the module functions.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+        magic, version, n_fields, start_ord, n_hours, heap_offset = ARCHIVE_HEADER.unpack_from(self._mm, 0)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION or n_fields != len(ARCHIVE_FIELDS):
+            self.close()
+            raise ValueError(f"Not a version {ARCHIVE_VERSION} IoT archive: {path}")
+        self.start = date.fromordinal(start_ord)
+        self.hours = n_hours
+        self._heap = heap_offset
+
+    def close(self) -> None:
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> "MappedArchive":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def _offset(self, date_str: str, hour: int) -> int:
+        return (parse_date_string(date_str) - self.start).days * 24 + hour
+
+    def _record(self, i: int) -> Optional[tuple]:
+        if not 0 <= i < self.hours:
+            return None
+        rec = ARCHIVE_RECORD.unpack_from(self._mm, ARCHIVE_HEADER.size + i * ARCHIVE_RECORD.size)
+        return rec if rec[2] & HOUR_PRESENT else None
+
+    def _row(self, rec: tuple, keys: Optional[List[str]]) -> Dict[str, str]:
+        raw_at = self._heap + rec[0]
+        if not keys:
+            return {"raw": str(self._view[raw_at:raw_at + rec[1]], "utf-8")}
+        row: Dict[str, str] = {}
+        for k in keys:
+            if k not in ARCHIVE_FIELDS:
+                continue
+            i = ARCHIVE_FIELDS.index(k)
+            if rec[2] & (1 << i):
+                a = raw_at + rec[3 + 2 * i]
+                row[k] = str(self._view[a:a + rec[4 + 2 * i]], "utf-8")
+        return row
+
+    def query_day(self, date_str: str, fields: Optional[List[str]] = None) -> Dict[int, Dict[str, str]]:
+        keys = normalize_fields(fields)
+        base = self._offset(date_str, 0)
+        result: Dict[int, Dict[str, str]] = {}
+        for h in range(24):
+            rec = self._record(base + h)
+            if rec is not None:
+                result[h] = self._row(rec, keys)
+        return result
+
+    def query_hours(self, date_str: str, hours: List[int],
+                    fields: Optional[List[str]] = None) -> Dict[int, Dict[str, str]]:
+        keys = normalize_fields(fields)
+        base = self._offset(date_str, 0)
+        result: Dict[int, Dict[str, str]] = {}
+        for h in sorted(hours):
+            rec = self._record(base + h)
+            result[h] = {"error": "file not found"} if rec is None else self._row(rec, keys)
+        return result
+
+    def numeric(self, field_key: str, stat: str = "value") -> Any:
+        """
+        One numeric column over all hours (NaN where missing). With NumPy
+        this is a zero-copy strided view into the mapping; drop it before
+        close().
+        """
+        col = ARCHIVE_FIELDS.index(field_key) * len(NUMERIC_STATS) + NUMERIC_STATS.index(stat)
+        if np is not None:
+            return np.ndarray((self.hours,), dtype="<f8", buffer=self._mm,
+                              offset=ARCHIVE_HEADER.size + _NUMERIC_BYTE + 8 * col,
+                              strides=(ARCHIVE_RECORD.size,))
+        out = array("d", [math.nan]) * self.hours
+        for i in range(self.hours):
+            rec = self._record(i)
+            if rec is not None:
+                out[i] = rec[_NUMERIC_FIRST + col]
+        return out
+
+
+# ---------- Gap analysis ----------
+
+@dataclass
+class GapReport:
+    """
+    Calendar-based coverage between two hour offsets (ordinal * 24 + hour,
+    end exclusive). outages are (first missing offset, hours missing), in
+    time order; consecutive missing hours are merged across day boundaries.
+    """
+    start: int
+    end: int
+    present: int
+    outages: List[Tuple[int, int]]
+
+    @property
+    def total(self) -> int:
+        return self.end - self.start
+
+    @property
+    def uptime_pct(self) -> float:
+        return 100.0 * self.present / self.total if self.total else 0.0
+
+    @property
+    def missing_days(self) -> int:
+        """
+        Calendar days with no file at all.
+        """
+        days = 0
+        for first, length in self.outages:
+            day_start = -(-first // 24) * 24  # first midnight at or after the outage start
+            days += max(0, (first + length - day_start) // 24)
+        return days
+
+    def longest(self, n: int = 5) -> List[Tuple[int, int]]:
+        return sorted(self.outages, key=lambda o: (-o[1], o[0]))[:n]
+
+
+def format_hour_offset(offset: int) -> str:
+    return f"{date.fromordinal(offset // 24).isoformat()} {offset % 24:02d}:00"
+
+
+def _present_offsets(idx: Union[ChunkIndex, MaskIndex]) -> List[int]:
+    """
+    Sorted hour offsets of every indexed file.
+    """
+    if isinstance(idx, MaskIndex):
+        return [o * 24 + h for o, m in zip(idx._days, idx._masks) for h in range(24) if m >> h & 1]
+    out: List[int] = []
+    for d in idx.dates():
+        base = parse_date_string(d).toordinal() * 24
+        out.extend(base + h for h in sorted(idx.hour_paths(d)))
+    return out
+
+
+def analyze_gaps(idx: Union[ChunkIndex, MaskIndex], start: Optional[DateLike] = None,
+                 end: Optional[DateLike] = None) -> GapReport:
+    """
+    Walk the calendar from start 00:00 to end 23:00 (default: the first to
+    the last indexed hour, as in date_range()) and merge missing hours into
+    outages, including whole days without any file. One sweep over the
+    sorted present offsets (np.diff when NumPy is installed).
+    """
+    offsets = _present_offsets(idx)
+    lo = _as_date(start).toordinal() * 24 if start is not None else (offsets[0] if offsets else 0)
+    hi = (_as_date(end).toordinal() + 1) * 24 if end is not None else (offsets[-1] + 1 if offsets else 0)
+    if hi <= lo:
+        return GapReport(lo, lo, 0, [])
+    offsets = offsets[bisect_left(offsets, lo):bisect_left(offsets, hi)]
+    # sentinels at both ends turn edge gaps into ordinary ones
+    points = [lo - 1] + offsets + [hi]
+    outages: List[Tuple[int, int]] = []
+    if np is not None:
+        arr = np.asarray(points, dtype=np.int64)
+        gaps = np.diff(arr) - 1
+        where = np.nonzero(gaps > 0)[0]
+        outages = [(int(arr[i]) + 1, int(gaps[i])) for i in where]
+    else:
+        for prev, cur in zip(points, points[1:]):
+            if cur - prev > 1:
+                outages.append((prev + 1, cur - prev - 1))
+    return GapReport(lo, hi, len(offsets), outages)
+
+
+def gap_report_text(report: GapReport, top: int = 5) -> List[str]:
+    if not report.total:
+        return ["Calendar gaps: no data"]
+    lines = [
+        f"Calendar coverage: {format_hour_offset(report.start)} -> {format_hour_offset(report.end - 1)}",
+        f"  Uptime: {report.uptime_pct:.2f}% ({report.present}/{report.total} hours)",
+        f"  Outages: {len(report.outages)}, fully missing days: {report.missing_days}",
+    ]
+    if report.outages:
+        lines.append("  Longest outages:")
+        for first, length in report.longest(top):
+            lines.append(f"    {format_hour_offset(first)} -> {format_hour_offset(first + length - 1)} ({length} h)")
+    return lines
+
+
+# ---------- Alerts ----------
+
+RULE_RE = re.compile(
+    r"^\s*(?P<field>.+?)(?P<delta>\s+delta)?\s*(?P<op><=|>=|<|>)\s*(?P<value>-?\d+(?:\.\d+)?)"
+    r"(?:\s*[^\s\d]\S*)?(?:\s+for\s+(?P<hours>\d+)\s*h)?\s*$",
+    re.I,
+)
+RULE_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+@dataclass
+class AlertRule:
+    """
+    'pm25 > 35 µg/m³ for 3h': the field's value crosses the threshold for
+    `hours` consecutive hours. With 'delta' ('co2 delta > 200 for 2h') the
+    change from the previous hour is tested instead (rate of change).
+    """
+    text: str
+    field: str
+    op: str
+    threshold: float
+    hours: int = 1
+    delta: bool = False
+
+
+def parse_rule(text: str) -> AlertRule:
+    m = RULE_RE.match(text)
+    if not m:
+        raise ValueError(f"Bad rule: {text!r} (expected e.g. 'pm25 > 35 for 3h')")
+    key = normalize_field_name(m.group("field"))
+    if key not in ALL_FIELDS:
+        raise ValueError(f"Unknown field in rule: {m.group('field')!r}")
+    hours = int(m.group("hours") or 1)
+    if hours < 1:
+        raise ValueError(f"Rule duration must be at least 1h: {text!r}")
+    return AlertRule(text.strip(), key, m.group("op"), float(m.group("value")), hours, bool(m.group("delta")))
+
+
+@dataclass
+class Alert:
+    """
+    A rule that held for its full duration: `start` is the first hour of
+    the run and `fired` the hour it reached the duration (hour offsets as
+    in GapReport); `value` is the tested value (or delta) at `fired`.
+    """
+    rule: str
+    site: str
+    start: int
+    fired: int
+    value: float
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"rule": self.rule, "site": self.site, "start": format_hour_offset(self.start),
+                "fired": format_hour_offset(self.fired), "value": self.value}
+
+
+class AlertEngine:
+    """
+    Evaluate rules over hours in chronological order, one site at a time.
+    Per (rule, site) the state is four numbers: run start, run length,
+    last hour offset and last value, so memory does not grow with history.
+    A missing hour (or a missing field) breaks every run. Each site has a
+    watermark, the last hour fed; older hours are ignored, so run() can be
+    called again after new chunks are indexed and only sees the new ones.
+    """
+
+    def __init__(self, rules: List[Union[str, AlertRule]]) -> None:
+        self.rules = [r if isinstance(r, AlertRule) else parse_rule(r) for r in rules]
+        self.fields = sorted({r.field for r in self.rules})
+        self.watermarks: Dict[str, int] = {}
+        # (rule index, site) -> [run start, run length, last offset, last value]
+        self._state: Dict[Tuple[int, str], List[Any]] = {}
+
+    def feed(self, site: str, offset: int, values: Dict[str, Optional[float]]) -> List[Alert]:
+        """
+        One hour of one site: field -> value (None or absent if missing).
+        """
+        if offset <= self.watermarks.get(site, -1):
+            return []
+        self.watermarks[site] = offset
+        fired: List[Alert] = []
+        for i, rule in enumerate(self.rules):
+            st = self._state.get((i, site))
+            if st is None:
+                st = self._state[(i, site)] = [offset, 0, None, None]
+            v = values.get(rule.field)
+            contiguous = st[2] == offset - 1
+            if rule.delta:
+                x = v - st[3] if v is not None and contiguous and st[3] is not None else None
+            else:
+                x = v
+            if x is not None and RULE_OPS[rule.op](x, rule.threshold):
+                if st[1] and contiguous:
+                    st[1] += 1
+                else:
+                    st[0], st[1] = offset, 1
+                if st[1] == rule.hours:
+                    fired.append(Alert(rule.text, site, st[0], offset, x))
+            else:
+                st[1] = 0
+            st[2], st[3] = offset, v
+        return fired
+
+    def run(self, idx: ChunkIndex, site: str = "", processes: Optional[int] = 1,
+            batch_size: int = 512) -> List[Alert]:
+        """
+        Feed every indexed hour after the site's watermark, parsed with
+        bulk_extract (only the fields the rules use; processes > 1 for
+        fast backfills). Returns the alerts that fired, in time order.
+        """
+        mark = self.watermarks.get(site, -1)
+        todo = ChunkIndex()
+        for d in idx.dates():
+            base = parse_date_string(d).toordinal() * 24
+            if base + 23 <= mark:
+                continue
+            for h, path in idx.hour_paths(d).items():
+                if base + h > mark:
+                    todo.add(d, h, path)
+        alerts: List[Alert] = []
+        for d, h, row in bulk_extract(todo, self.fields, processes, batch_size):
+            values = {k: parse_measurement(v).get("value") for k, v in row.items()}
+            alerts.extend(self.feed(site, parse_date_string(d).toordinal() * 24 + h, values))
+        return alerts
+
+    def run_sites(self, sites: SiteIndex, processes: Optional[int] = 1) -> List[Alert]:
+        alerts: List[Alert] = []
+        for name in sorted(sites):
+            alerts.extend(self.run(sites[name], name, processes))
+        return alerts
+
+    def save(self, path: str) -> None:
+        state = {
+            "rules": [r.text for r in self.rules],
+            "watermarks": self.watermarks,
+            "state": [[i, site, st] for (i, site), st in self._state.items()],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    @classmethod
+    def load(cls, path: str, rules: List[Union[str, AlertRule]]) -> "AlertEngine":
+        """
+        Engine for `rules`, resumed from a save() file if it was written for
+        the same rules; otherwise (or with no file) a fresh one.
+        """
+        engine = cls(rules)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return engine
+        if state.get("rules") == [r.text for r in engine.rules]:
+            engine.watermarks = {site: int(o) for site, o in state["watermarks"].items()}
+            engine._state = {(i, site): st for i, site, st in state["state"]}
+        return engine
+
+
+# ---------- Reporting ----------
+
+def inspection_report(idx: ChunkIndex) -> str:
+    lines: List[str] = []
+    lines.append("=== Inspection Report ===")
+    lines.append(f"Days covered: {idx.day_count}")
+    start, end = idx.date_range()
+    lines.append(f"Date range: {start} -> {end}")
+    lines.append("Per‑day completeness (missing hours listed):")
+    for d in idx.dates():
+        miss = idx.missing_hours(d)
+        if miss:
+            lines.append(f"  {d}: missing {', '.join(f'{h:02d} hour file' for h in miss)}")
+        else:
+            lines.append(f"  {d}: complete (24/24)")
+    # Days with no file at all only show up against the calendar
+    lines.extend(gap_report_text(analyze_gaps(idx)))
+    return "\n".join(lines)
+
+
+def _iter_block(label: str, row: Dict[str, str], fields: Optional[List[str]]) -> Iterator[str]:
+    yield f"[{label}]"
+    if "error" in row:
+        yield f"  ERROR: {row['error']}"
+    elif fields:
+        for k, v in row.items():
+            yield f"  {k}: {v}"
+    else:
+        yield row.get("raw", "")
+
+
+def iter_query_output_day(result: Dict[int, Dict[str, str]], fields: Optional[List[str]]) -> Iterator[str]:
+    """
+    Lines of format_query_output_day, one at a time.
+    """
+    first = True
+    for h in range(24):
+        if h not in result:
+            continue
+        if not first:
+            yield ""
+        first = False
+        yield from _iter_block(f"{h:02d}:00", result[h], fields)
+
+
+def iter_query_output_hours(result: Dict[int, Dict[str, str]], fields: Optional[List[str]]) -> Iterator[str]:
+    """
+    Lines of format_query_output_hours, one at a time.
+    """
+    for i, h in enumerate(sorted(result.keys())):
+        if i:
+            yield ""
+        yield from _iter_block(f"{h:02d}:00", result[h], fields)
+
+
+def iter_query_output_range(rows: Iterable[Tuple[str, int, Dict[str, str]]],
+                            fields: Optional[List[str]]) -> Iterator[str]:
+    """
+    Lines for query_range rows, produced as the rows arrive.
+    """
+    for i, (date_str, h, row) in enumerate(rows):
+        if i:
+            yield ""
+        yield from _iter_block(f"{date_str} {h:02d}:00", row, fields)
+
+
+def write_output(lines: Iterable[str], out: Any, flush_every: Optional[int] = None) -> int:
+    """
+    Write lines to any text file-like sink (stdout, socket.makefile("w"),
+    gzip.open(..., "wt")) without holding them all in memory. flush_every=N
+    flushes after every N lines (1 = each line); None leaves it to the sink.
+    Returns the number of lines written.
+    """
+    n = 0
+    for line in lines:
+        out.write(line)
+        out.write("\n")
+        n += 1
+        if flush_every and n % flush_every == 0:
+            out.flush()
+    if flush_every:
+        out.flush()
+    return n
+
+
+def format_query_output_day(result: Dict[int, Dict[str, str]], fields: Optional[List[str]]) -> str:
+    return "\n".join(iter_query_output_day(result, fields)).strip()
+
+
+def format_query_output_hours(result: Dict[int, Dict[str, str]], fields: Optional[List[str]]) -> str:
+    return "\n".join(iter_query_output_hours(result, fields)).strip()
+
+
+def format_query_output_range(rows: Iterable[Tuple[str, int, Dict[str, str]]], fields: Optional[List[str]]) -> str:
+    return "\n".join(iter_query_output_range(rows, fields)).strip()
+
+
+# ---------- HTTP service ----------
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+HTTP_IDLE_TIMEOUT = 15.0
+
+
+def _split_list(value: Optional[str]) -> Optional[List[str]]:
+    if not value:
+        return None
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _hours_json(result: Dict[int, Dict[str, str]]) -> Dict[str, Dict[str, str]]:
+    return {f"{h:02d}": row for h, row in sorted(result.items())}
+
+
+class QueryService:
+    """
+    JSON query service over one warm ChunkIndex + ParseCache.
+    Endpoints (GET):
+      /inspect
+      /day?date=2025-08-01&fields=co2,pm25
+      /hours?date=2025-08-01&hours=3,16&fields=co2
+      /range?from=2025-08-01&to=2025-08-31&hours=&fields=co2
+      /quantiles?field=co2&from=2025-01-01&to=2025-12-31&q=50,95,99
+      /stats
+    Requests are parsed on the event loop; queries (file reads and parsing)
+    run on a thread pool so a slow read never stalls other connections.
+    The watcher keeps the index current; queries work on a snapshot of the
+    days they touch, taken under a lock.
+    """
+
+    def __init__(self, idx: ChunkIndex, folder: str, cache: Optional[ParseCache] = None,
+                 workers: int = 8) -> None:
+        self.idx = idx
+        self.cache = cache if cache is not None else ParseCache()
+        self.watcher = ChunkWatcher(idx, folder, self.cache)
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self.folder = folder
+        self.rollups: Optional[Rollups] = None
+        self._rollups_stale = True  # set whenever the watcher reports changes
+        self._rollup_lock = threading.Lock()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.watcher.close()
+
+    def _poll(self) -> None:
+        """
+        Apply pending file changes to the index; call with self._lock held.
+        """
+        if self.watcher.poll():
+            self._rollups_stale = True
+
+    def _snapshot(self, start: date, end: date) -> ChunkIndex:
+        snap = ChunkIndex()
+        with self._lock:
+            self._poll()
+            d = start
+            while d <= end:
+                date_str = d.isoformat()
+                by_hour = self.idx.hour_paths(date_str)
+                if by_hour:
+                    snap.by_date[date_str] = dict(by_hour)
+                d += timedelta(days=1)
+        return snap
+
+    def _quantiles(self, params: Dict[str, str]) -> Dict[str, Any]:
+        """
+        /quantiles on rollups brought up to date with the index: loaded from
+        the sidecar on first use, then refreshed (only changed days are
+        parsed again) only after the watcher has reported changes, so a warm
+        request does not stat the whole archive. The answer is computed
+        under the same lock as the refresh, so no update mutates the tiers
+        while they are being merged.
+        """
+        qs = [float(q) for q in _split_list(params.get("q")) or []] or DEFAULT_QUANTILES
+        with self._rollup_lock:
+            with self._lock:
+                self._poll()
+                stale = self.rollups is None or self._rollups_stale
+                if stale:
+                    snap = ChunkIndex({d: dict(by_hour) for d, by_hour in self.idx.by_date.items()})
+                    self._rollups_stale = False
+            if self.rollups is None:
+                self.rollups = build_rollups(snap, self.folder)
+            elif stale:
+                self.rollups.update(snap)
+            return range_quantiles(self.rollups, params.get("field", ""),
+                                   params.get("from") or None, params.get("to") or None, qs)
+
+    def handle(self, path: str, params: Dict[str, str]) -> Tuple[int, Any]:
+        """
+        Answer one request: (HTTP status, JSON-able payload).
+        """
+        try:
+            fields = _split_list(params.get("fields"))
+            if path == "/inspect":
+                with self._lock:
+                    self._poll()
+                    start, end = self.idx.date_range()
+                    missing = {d: self.idx.missing_hours(d) for d in self.idx.dates()}
+                return 200, {"days_covered": len(missing), "date_range": [start, end], "missing_hours": missing}
+            if path == "/stats":
+                return 200, {"cache": self.cache.stats(), "days_covered": self.idx.day_count}
+            if path in ("/day", "/hours"):
+                d = parse_date_string(params.get("date", ""))
+                date_str = d.isoformat()
+                snap = self._snapshot(d, d)
+                if path == "/day":
+                    result = query_day(snap, date_str, fields, self.cache)
+                else:
+                    hours = parse_hours_string(params.get("hours", ""))
+                    result = query_hours(snap, date_str, hours, fields, self.cache)
+                return 200, {"date": date_str, "hours": _hours_json(result)}
+            if path == "/range":
+                start, end = parse_date_range_string(f"{params.get('from', '')}..{params.get('to', '')}")
+                hours = parse_hours_string(params["hours"]) if params.get("hours") else None
+                snap = self._snapshot(start, end)
+                # already on a pool thread: read sequentially here
+                rows = query_range(snap, start, end, hours, fields, self.cache, workers=1)
+                return 200, {"rows": [dict(row, date=d, hour=h) for d, h, row in rows]}
+            if path == "/quantiles":
+                return 200, self._quantiles(params)
+            return 404, {"error": f"unknown endpoint {path}"}
+        except (OSError, UnicodeDecodeError) as e:
+            # a chunk vanished, was replaced or is corrupt: not the client's fault
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+        except (ValueError, KeyError) as e:
+            return 400, {"error": str(e)}
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("ascii") + body)
+        await writer.drain()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serve requests on one connection until the client closes it, asks
+        for Connection: close, or stays idle for HTTP_IDLE_TIMEOUT seconds.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), HTTP_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", "0") or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad Content-Length"}, False)
+                    break
+                if length:
+                    await reader.readexactly(length)
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    await self._respond(writer, 400, {"error": "malformed request line"}, False)
+                    break
+                method, target, version = parts
+                conn = headers.get("connection", "").lower()
+                keep_alive = conn != "close" if version == "HTTP/1.1" else conn == "keep-alive"
+                if method != "GET":
+                    status, payload = 405, {"error": f"method {method} not allowed"}
+                else:
+                    url = urlsplit(target)
+                    params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                    try:
+                        status, payload = await loop.run_in_executor(self._executor, self.handle, url.path, params)
+                    except Exception as e:
+                        status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8050) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle_client, host, port)
+
+
+def serve(idx: ChunkIndex, folder: str, host: str = "127.0.0.1", port: int = 8050,
+          cache: Optional[ParseCache] = None, workers: int = 8) -> None:
+    """
+    Run the QueryService until interrupted (Ctrl+C).
+    """
+    service = QueryService(idx, folder, cache, workers)
+
+    async def run() -> None:
+        server = await service.start(host, port)
+        print(f"Serving on http://{host}:{port} (Ctrl+C to stop)")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+# ---------- Instrumentation ----------
+
+# Module functions that enable_instrumentation() wraps. Times are inclusive:
+# query_day includes the read_file and parse_chunk_text calls it makes.
+INSTRUMENTED_STAGES = (
+    "index_chunks", "index_chunks_cached", "read_file", "parse_chunk_text",
+    "query_day", "query_hours", "query_range",
+    "format_query_output_day", "format_query_output_hours", "format_query_output_range",
+    "write_output", "write_rows",
+)
+
+
+class StageStats:
+    """
+    Counters for one stage: calls, total time, bytes and a log2 latency
+    histogram (bucket b holds calls that took < 2**b microseconds).
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total_ns = 0
+        self.bytes = 0
+        self.histogram: Dict[int, int] = {}
+
+    def record(self, elapsed_ns: int, nbytes: int) -> None:
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        self.bytes += nbytes
+        bucket = (elapsed_ns // 1000).bit_length()
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def quantile_us(self, q: float) -> int:
+        """
+        Upper bound of the histogram bucket holding the q-th quantile.
+        """
+        rank = q * self.calls
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return 1 << bucket
+        return 0
+
+
+class Instrumentation:
+    """
+    Opt-in per-stage counters. While disabled nothing is wrapped, so the
+    hot paths run exactly as without it.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.stages: Dict[str, StageStats] = {}
+        self._originals: Dict[str, Callable] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, elapsed_ns: int, nbytes: int = 0) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, StageStats()).record(elapsed_ns, nbytes)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages.clear()
+
+    def summary(self) -> str:
+        lines = ["=== Stage statistics ===",
+                 f"{'stage':<26}{'calls':>9}{'total ms':>11}{'mean us':>10}{'p50 us':>9}{'p99 us':>9}{'bytes':>13}"]
+        with self._lock:
+            for name in sorted(self.stages, key=lambda n: -self.stages[n].total_ns):
+                st = self.stages[name]
+                lines.append(
+                    f"{name:<26}{st.calls:>9}{st.total_ns / 1e6:>11.1f}{st.total_ns / 1e3 / st.calls:>10.1f}"
+                    f"{st.quantile_us(0.5):>9}{st.quantile_us(0.99):>9}{st.bytes:>13}"
+                )
+        if len(lines) == 2:
+            lines.append("  (no calls recorded)")
+        return "\n".join(lines)
+
+
+STATS = Instrumentation()
+
+
+def _result_bytes(value: Any) -> int:
+    return len(value.encode("utf-8")) if isinstance(value, str) else 0
+
+
+def _timed_iter(stage: str, it: Iterator) -> Iterator:
+    """
+    Pass a generator through, charging only the time spent producing items.
+    """
+    total = 0
+    try:
+        while True:
+            t = time.perf_counter_ns()
+            try:
+                item = next(it)
+            except StopIteration:
+                total += time.perf_counter_ns() - t
+                return
+            total += time.perf_counter_ns() - t
+            yield item
+    finally:
+        STATS.record(stage, total)
+
+
+def _instrument(stage: str, fn: Callable) -> Callable:
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        t = time.perf_counter_ns()
+        result = fn(*args, **kwargs)
+        if isinstance(result, Iterator) and not isinstance(result, (str, dict, list)):
+            return _timed_iter(stage, result)
+        STATS.record(stage, time.perf_counter_ns() - t, _result_bytes(result))
+        return result
+    wrapper.__wrapped__ = fn
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def enable_instrumentation(summary_at_exit: bool = False) -> None:
+    """
+    Wrap INSTRUMENTED_STAGES in this module with timing wrappers.
+    Work done in bulk_extract worker processes is not counted.
+    """
+    g = globals()
+    with STATS._lock:
+        if STATS.enabled:
+            return
+        for name in INSTRUMENTED_STAGES:
+            STATS._originals[name] = g[name]
+            g[name] = _instrument(name, g[name])
+        STATS.enabled = True
+    if summary_at_exit:
+        atexit.register(lambda: print(STATS.summary(), file=sys.stderr))
+
+
+def disable_instrumentation() -> None:
+    g = globals()
+    with STATS._lock:
+        for name, fn in STATS._originals.items():
+            g[name] = fn
+        STATS._originals.clear()
+        STATS.enabled = False
+
+
+def profile_call(path: str, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Run fn(*args, **kwargs) under cProfile and write pstats data to path
+    (inspect with: python -m pstats path).
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+
+
+# ---------- Batch CLI ----------
+
+OUTPUT_FORMATS = ("jsonl", "csv", "text")
+
+
+def _add_query_args(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--date", help="single day, YYYYMMDD or YYYY-MM-DD")
+    p.add_argument("--from", dest="start", help="first day of a range")
+    p.add_argument("--to", dest="end", help="last day of a range (default: --from)")
+    p.add_argument("--hours", help="e.g. '3:00, 16:00'; default: every hour with a file")
+    p.add_argument("--fields", help="comma-separated, e.g. co2,pm25; default: raw text")
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="project.py", description="IoT Data Inspector & Query Tool")
+    parser.add_argument("--stats", action="store_true", help="print per-stage statistics to stderr at exit")
+    parser.add_argument("--profile", metavar="FILE", help="write a cProfile/pstats dump of the command to FILE")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("inspect", help="inspection report")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--format", choices=("text", "json"), default="text")
+
+    p = sub.add_parser("query", help="one day or date-range query")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--format", choices=OUTPUT_FORMATS, default="jsonl")
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--flush-every", type=int, default=None, metavar="N",
+                   help="flush output every N lines (default: when the buffer fills)")
+    _add_query_args(p)
+
+    p = sub.add_parser("batch", help="many queries, one per line (query options), from a file or stdin")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--file", default="-", help="query file, '-' for stdin (default)")
+
+    p = sub.add_parser("export", help="incremental columnar export, one file per month")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--out", required=True, help="output directory")
+    p.add_argument("--fields", help="comma-separated; default: all six")
+    p.add_argument("--format", choices=("auto", "parquet", "csv"), default="auto")
+    p.add_argument("--processes", type=int, default=1, help="parse with N processes")
+
+    p = sub.add_parser("rollup", help="per day/week/month statistics from the rollup tiers")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--field", required=True)
+    p.add_argument("--period", choices=AGG_PERIODS, default="month")
+    # own dest: the top-level --stats (instrumentation) uses "stats"
+    p.add_argument("--stats", dest="agg_stats", help=f"comma-separated; default: {','.join(DEFAULT_AGG_STATS)}")
+    p.add_argument("--from", dest="start", help="first day")
+    p.add_argument("--to", dest="end", help="last day")
+    p.add_argument("--processes", type=int, default=1, help="parse new days with N processes")
+    p.add_argument("--exact", action="store_true",
+                   help="exact percentiles from a column store (reads every chunk) instead of the rollups")
+
+    p = sub.add_parser("quantiles", help="approximate percentiles over a range, one folder or many sites")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--root", action="append", help="index sites under these roots instead of --folder (repeatable)")
+    p.add_argument("--site", help="with --root: only this site (default: all merged)")
+    p.add_argument("--rollup-dir", help="with --root: keep per-site rollups here")
+    p.add_argument("--field", required=True)
+    p.add_argument("--q", help="comma-separated percentiles; default: 50,95,99")
+    p.add_argument("--from", dest="start", help="first day")
+    p.add_argument("--to", dest="end", help="last day")
+
+    p = sub.add_parser("search", help="hours whose chunk text matches all words, e.g. 'ieq:poor'")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--query", required=True)
+    p.add_argument("--from", dest="start", help="first day")
+    p.add_argument("--to", dest="end", help="last day")
+    p.add_argument("--fields", help="comma-separated fields to print for each hit")
+    p.add_argument("--processes", type=int, default=1, help="tokenize new days with N processes")
+
+    p = sub.add_parser("ingest", help="load parsed chunks into a SQLite database")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--db", required=True)
+    p.add_argument("--site", help="site name (default: the folder's name)")
+    p.add_argument("--processes", type=int, default=1, help="parse with N processes")
+
+    p = sub.add_parser("where", help="hours matching thresholds, from a SQLite database")
+    p.add_argument("--db", required=True)
+    p.add_argument("--filter", required=True, help="e.g. 'co2>1000, humidity>60'")
+    p.add_argument("--from", dest="start", help="first day")
+    p.add_argument("--to", dest="end", help="last day")
+    p.add_argument("--site")
+    p.add_argument("--fields", help="comma-separated; default: the filtered fields")
+    p.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+
+    p = sub.add_parser("alerts", help="evaluate threshold rules over the archive, then optionally follow it")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--rule", action="append", required=True, help="e.g. 'pm25 > 35 for 3h' (repeatable)")
+    p.add_argument("--site", help="site name (default: the folder's name)")
+    p.add_argument("--state", help="save/resume engine state (watermark) in this file")
+    p.add_argument("--processes", type=int, default=1, help="parse with N processes")
+    p.add_argument("--follow", action="store_true", help="keep watching the folder for new chunks")
+    p.add_argument("--interval", type=float, default=5.0)
+
+    p = sub.add_parser("serve", help="HTTP JSON service")
+    p.add_argument("--folder", default=".")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8050)
+    p.add_argument("--workers", type=int, default=8)
+    return parser
+
+
+def _query_parser() -> argparse.ArgumentParser:
+    """
+    Parser for one line of a batch file: the query options only.
+    """
+    p = argparse.ArgumentParser(prog="batch query", add_help=False, exit_on_error=False)
+    _add_query_args(p)
+    return p
+
+
+def _run_query(idx: ChunkIndex, args: argparse.Namespace, cache: ParseCache,
+               workers: int) -> Tuple[Optional[List[str]], Iterator[Tuple[str, int, Dict[str, str]]]]:
+    """
+    (fields, rows) for parsed query options; raises ValueError on bad input.
+    """
+    if args.date:
+        if args.start or args.end:
+            raise ValueError("use either --date or --from/--to")
+        start = end = parse_date_string(args.date)
+    elif args.start:
+        start = parse_date_string(args.start)
+        end = parse_date_string(args.end) if args.end else start
+    else:
+        raise ValueError("--date or --from is required")
+    if end < start:
+        raise ValueError(f"--to {end} is before --from {start}")
+    hours = parse_hours_string(args.hours) if args.hours else None
+    fields = _split_list(args.fields)
+    return fields, query_range(idx, start, end, hours, fields, cache, workers)
+
+
+def write_rows(rows: Iterable[Tuple[str, int, Dict[str, str]]], fmt: str, out: Any,
+               query_id: Optional[int] = None, flush_every: Optional[int] = None) -> int:
+    """
+    Stream query rows to `out` as JSON lines or long-format CSV
+    (date, hour, field, value); returns the number of rows written.
+    flush_every works as in write_output, counted in rows.
+    """
+    n = 0
+    writer = csv.writer(out) if fmt == "csv" else None
+    for date_str, h, row in rows:
+        if writer is not None:
+            for k, v in row.items():
+                writer.writerow(([query_id] if query_id is not None else []) + [date_str, f"{h:02d}", k, v])
+        else:
+            rec: Dict[str, Any] = {"query": query_id} if query_id is not None else {}
+            rec.update(date=date_str, hour=h)
+            rec.update(row)
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        n += 1
+        if flush_every and n % flush_every == 0:
+            out.flush()
+    if flush_every:
+        out.flush()
+    return n
+
+
+def run_cli(argv: List[str]) -> int:
+    """
+    Non-interactive entry point; returns the process exit code.
+    The index is built once per invocation, however many queries a batch has.
+    """
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.stats or os.environ.get("IOT_INSPECTOR_STATS"):
+        enable_instrumentation(summary_at_exit=True)
+    if args.profile:
+        return profile_call(args.profile, _run_command, parser, args)
+    return _run_command(parser, args)
+
+
+def _run_command(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    out = sys.stdout
+    if args.command == "where":
+        with SqliteStore(args.db) as store:
+            try:
+                hits = store.where(args.filter, args.start, args.end, args.site, _split_list(args.fields))
+            except ValueError as e:
+                parser.error(str(e))
+            if args.format == "csv":
+                csv.writer(out).writerow(["date", "hour", "field", "value"])
+            write_rows(((d, h, {"site": s, **row}) for s, d, h, row in hits), args.format, out)
+        return 0
+
+    if args.command == "quantiles":
+        try:
+            qs = [float(q) for q in _split_list(args.q) or []] or DEFAULT_QUANTILES
+            if args.root:
+                rollups: Union[Rollups, SiteRollups] = site_rollups(index_sites(args.root), args.rollup_dir)
+            else:
+                rollups = build_rollups(index_chunks_cached(args.folder), args.folder)
+            result = range_quantiles(rollups, args.field, args.start, args.end, qs, args.site)
+        except (ValueError, KeyError) as e:
+            parser.error(str(e))
+        json.dump(result, out)
+        out.write("\n")
+        return 0
+
+    idx = index_chunks_cached(args.folder)
+    cache = ParseCache()
+
+    if args.command == "inspect":
+        if args.format == "json":
+            start, end = idx.date_range()
+            missing = {d: idx.missing_hours(d) for d in idx.dates()}
+            json.dump({"days_covered": idx.day_count, "date_range": [start, end], "missing_hours": missing}, out)
+            out.write("\n")
+        else:
+            print(inspection_report(idx))
+        return 0
+
+    if args.command == "export":
+        summary = export_columnar(idx, args.out, _split_list(args.fields), args.format, processes=args.processes)
+        print(f"{summary['format']}: {len(summary['written'])} month(s) written ({summary['rows']} rows), "
+              f"{len(summary['unchanged'])} unchanged, {len(summary['removed'])} removed")
+        return 0
+
+    if args.command == "rollup":
+        stats = tuple(_split_list(args.agg_stats) or DEFAULT_AGG_STATS)
+        try:
+            if args.exact:
+                store = build_column_store(idx, processes=args.processes)
+                rows = aggregate(store, args.field, args.period, stats, args.start, args.end)
+            else:
+                rollups = build_rollups(idx, args.folder, processes=args.processes)
+                rows = rollups.aggregate(args.field, args.period, stats, args.start, args.end)
+        except ValueError as e:
+            parser.error(str(e))
+        print(format_aggregate_output(rows, stats, approx=not args.exact))
+        return 0
+
+    if args.command == "search":
+        try:
+            sidx = build_search_index(idx, args.folder, processes=args.processes)
+            fields = _split_list(args.fields)
+            if fields:
+                write_rows(search_rows(idx, sidx, args.query, args.start, args.end, fields, cache), "jsonl", out)
+            else:
+                write_rows(((d, h, {}) for d, h in sidx.search(args.query, args.start, args.end)), "jsonl", out)
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+
+    if args.command == "ingest":
+        site = args.site or os.path.basename(os.path.abspath(args.folder))
+        with SqliteStore(args.db) as store:
+            summary = store.ingest(idx, site, args.processes)
+        print(f"{site}: {summary['ingested']} ingested, {summary['unchanged']} unchanged, "
+              f"{summary['removed']} removed")
+        return 0
+
+    if args.command == "alerts":
+        site = args.site or os.path.basename(os.path.abspath(args.folder))
+        try:
+            engine = AlertEngine.load(args.state, args.rule) if args.state else AlertEngine(args.rule)
+        except ValueError as e:
+            parser.error(str(e))
+
+        def emit(_n: int = 0) -> None:
+            for alert in engine.run(idx, site, args.processes):
+                out.write(json.dumps(alert.as_dict(), ensure_ascii=False) + "\n")
+            out.flush()
+            if args.state:
+                engine.save(args.state)
+
+        emit()
+        if args.follow:
+            watcher = ChunkWatcher(idx, args.folder, cache)
+            try:
+                watch(watcher, args.interval, on_change=emit)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                watcher.close()
+        return 0
+
+    if args.command == "serve":
+        serve(idx, args.folder, args.host, args.port, cache, args.workers)
+        return 0
+
+    if args.command == "query":
+        try:
+            fields, rows = _run_query(idx, args, cache, args.workers)
+            if args.format == "text":
+                write_output(iter_query_output_range(rows, fields), out, flush_every=args.flush_every)
+                return 0
+            if args.format == "csv":
+                csv.writer(out).writerow(["date", "hour", "field", "value"])
+            write_rows(rows, args.format, out, flush_every=args.flush_every)
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+
+    # batch
+    status = 0
+    qparser = _query_parser()
+    src = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8")
+    try:
+        if args.format == "csv":
+            csv.writer(out).writerow(["query", "date", "hour", "field", "value"])
+        for n, line in enumerate(src, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                qargs, extra = qparser.parse_known_args(shlex.split(line))
+                if extra:
+                    raise ValueError(f"unrecognized arguments: {' '.join(extra)}")
+                _, rows = _run_query(idx, qargs, cache, args.workers)
+                write_rows(rows, args.format, out, query_id=n)
+            except (ValueError, argparse.ArgumentError) as e:
+                status = 1
+                if args.format == "csv":
+                    csv.writer(out).writerow([n, "", "", "error", str(e)])
+                else:
+                    out.write(json.dumps({"query": n, "error": str(e)}, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if src is not sys.stdin:
+            src.close()
+    return status
+
+
+# ---------- CLI main ----------
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    With command-line arguments, run the batch CLI (see build_arg_parser);
+    without, the interactive menu.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        sys.exit(run_cli(argv))
+    if os.environ.get("IOT_INSPECTOR_STATS"):
+        enable_instrumentation(summary_at_exit=True)
+    interactive()
+
+
+def interactive() -> None:
+    print("IoT Data Inspector & Query Tool")
+    folder = input("Data folder (where chunk_YYYY-MM-DD_HH.txt lives): ").strip() or "."
+    idx = index_chunks_cached(folder)
+    cache = ParseCache()
+    rollups: Optional[Rollups] = None  # loaded/updated on first aggregate
+    store: Optional[ColumnStore] = None  # built on first exact aggregate
+    search: Optional[SearchIndex] = None  # loaded/updated on first search
+    watcher = ChunkWatcher(idx, folder, cache)
+    while True:
+        if watcher.poll():
+            rollups = search = store = None
+        print("\n" + "-" * 20)
+        print("Choose mode:")
+        print("  1) Inspect")
+        print("  2) Query")
+        print("  3) Aggregate")
+        print("  4) Serve (HTTP JSON API)")
+        print("  5) Stats")
+        print("  6) Search")
+        print("  q) Quit")
+        choice = input("> ").strip().lower()
+        if choice == "1":
+            print(inspection_report(idx))
+        elif choice == "2":
+            date_in = input("Date (YYYYMMDD or YYYY-MM-DD, or a range START..END): ").strip()
+            try:
+                d, d_end = parse_date_range_string(date_in)
+            except Exception as e:
+                print(f"Invalid date: {e}")
+                continue
+            date_str = d.strftime("%Y-%m-%d")
+            hours_in = input("Hours (e.g., '3:00, 16:00') or blank for whole day: ").strip()
+            fields_in = input("Fields (comma, case-insensitive; e.g. 'Temperature, CO2, IEQ median') or blank for ALL: ").strip()
+            fields = [f.strip() for f in fields_in.split(",")] if fields_in else None
+            hours = None
+            if hours_in:
+                try:
+                    hours = parse_hours_string(hours_in)
+                except Exception as e:
+                    print(f"Invalid hours: {e}")
+                    continue
+            if d_end != d:
+                rows = query_range(idx, d, d_end, hours, fields, cache)
+                write_output(iter_query_output_range(rows, fields), sys.stdout)
+            elif hours:
+                result = query_hours(idx, date_str, hours, fields, cache)
+                write_output(iter_query_output_hours(result, fields), sys.stdout)
+            else:
+                result = query_day(idx, date_str, fields, cache)
+                write_output(iter_query_output_day(result, fields), sys.stdout)
+        elif choice == "3":
+            field_in = input("Field (e.g. 'CO2'): ").strip()
+            period = input("Period (day/week/month) [day]: ").strip().lower() or "day"
+            range_in = input("Date range START..END or blank for all: ").strip()
+            stats_in = input(f"Stats (comma; default {', '.join(DEFAULT_AGG_STATS)}): ").strip()
+            stats = tuple(x.strip().lower() for x in stats_in.split(",") if x.strip()) or DEFAULT_AGG_STATS
+            exact = input("Exact percentiles (reads every chunk)? [y/N]: ").strip().lower() == "y"
+            try:
+                start, end = parse_date_range_string(range_in) if range_in else (None, None)
+                if exact:
+                    if store is None:
+                        store = build_column_store(idx)
+                    rows = aggregate(store, field_in, period, stats, start, end)
+                else:
+                    if rollups is None:
+                        rollups = build_rollups(idx, folder)
+                    rows = rollups.aggregate(field_in, period, stats, start, end)
+            except Exception as e:
+                print(f"Invalid aggregate: {e}")
+                continue
+            print(format_aggregate_output(rows, stats, approx=not exact))
+        elif choice == "4":
+            port_in = input("Port [8050]: ").strip()
+            try:
+                port = int(port_in) if port_in else 8050
+            except ValueError:
+                print(f"Invalid port: {port_in}")
+                continue
+            watcher.close()
+            serve(idx, folder, port=port, cache=cache)
+            watcher = ChunkWatcher(idx, folder, cache)
+            rollups = search = store = None
+        elif choice == "5":
+            print(f"Parse cache: {cache.stats()}")
+            if STATS.enabled:
+                print(STATS.summary())
+            elif input("Instrumentation is off. Enable it? [y/N]: ").strip().lower() == "y":
+                enable_instrumentation()
+                print("Enabled: stage statistics are collected from now on.")
+        elif choice == "6":
+            query_in = input("Search (words or field:label, e.g. 'ieq:poor'): ").strip()
+            range_in = input("Date range START..END or blank for all: ").strip()
+            fields_in = input("Fields to show (comma) or blank for none: ").strip()
+            fields = [f.strip() for f in fields_in.split(",")] if fields_in else None
+            try:
+                start, end = parse_date_range_string(range_in) if range_in else (None, None)
+                if search is None:
+                    search = build_search_index(idx, folder)
+                hits = search.search(query_in, start, end)
+            except Exception as e:
+                print(f"Invalid search: {e}")
+                continue
+            print(f"{len(hits)} matching hour(s)")
+            if fields:
+                rows = search_rows(idx, search, query_in, start, end, fields, cache)
+                write_output(iter_query_output_range(rows, fields), sys.stdout)
             else:
-                result = query_day(idx, date_str, fields)
-                print(format_query_output_day(result, fields))
+                for d, h in hits:
+                    print(f"{d} {h:02d}:00")
         elif choice in ("q", "quit", "exit"):
+            watcher.close()
             break
         else:
             print("Unknown choice.")
@@ -1,8 +1,11 @@
 
+import math
 import os
 from pathlib import Path
 import textwrap
 
+import pytest
+
 import project
 
 SAMPLE = """Data: 2025-09-11
@@ -72,3 +75,745 @@ def test_query_day_and_hours(tmp_path: Path):
 
     res_hours = project.query_hours(idx, "2025-08-11", [1], fields=None)
 
+
+
+def test_index_chunks_cached(tmp_path: Path):
+    _make_file(tmp_path, "chunk_2025-08-10_00.txt", SAMPLE)
+    _make_file(tmp_path, "chunk_2025-08-10_05.txt", SAMPLE)
+
+    idx = project.index_chunks_cached(str(tmp_path))
+    assert (tmp_path / project.INDEX_FILENAME).exists()
+    assert sorted(idx.by_date["2025-08-10"]) == [0, 5]
+
+    # unchanged folder: served from the sidecar, same paths as a full scan
+    reloaded = project.load_index(str(tmp_path), str(tmp_path / project.INDEX_FILENAME))
+    assert reloaded is not None
+    assert reloaded.by_date == project.index_chunks(str(tmp_path)).by_date
+
+    # a new hourly file changes the folder mtime and is picked up
+    _make_file(tmp_path, "chunk_2025-08-11_03.txt", SAMPLE)
+    st = os.stat(tmp_path)
+    os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    idx = project.index_chunks_cached(str(tmp_path))
+    assert 3 in idx.by_date["2025-08-11"]
+
+
+def test_parse_cache_hits_and_eviction(tmp_path: Path):
+    for h in range(3):
+        _make_file(tmp_path, f"chunk_2025-08-11_{h:02d}.txt", SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+    cache = project.ParseCache()
+
+    first = project.query_day(idx, "2025-08-11", fields=["co2"], cache=cache)
+    second = project.query_day(idx, "2025-08-11", fields=["co2"], cache=cache)
+    assert first == second
+    assert cache.misses == 3 and cache.hits == 3
+
+    # rewritten file (different size) is re-read, not served stale
+    path = tmp_path / "chunk_2025-08-11_00.txt"
+    path.write_text(SAMPLE.replace("428–438", "900–950"), encoding="utf-8")
+    res = project.query_hours(idx, "2025-08-11", [0], fields=["co2"], cache=cache)
+    assert res[0]["co2"].startswith("900")
+
+    # a tiny budget keeps only what fits
+    small = project.ParseCache(max_bytes=cache.bytes // 2)
+    project.query_day(idx, "2025-08-11", cache=small)
+    assert small.bytes <= small.max_bytes
+    assert len(small) < 3
+
+
+def test_parse_chunk_text_single_pass_semantics():
+    text = "  Temperature: first\r\nTemperature: second\nco2:\nCO2 : spaced\nNote: pm2.5: inline\nPM 25: 9 µg/m³\n"
+    data = project.parse_chunk_text(text)
+    assert data["temperature"] == "first"  # first occurrence wins, CR stripped
+    assert "co2" not in data  # empty value and space before colon don't match
+    assert data["pm25"] == "9 µg/m³"  # only at line start
+    assert project.extract_fields(SAMPLE, frozenset({"co2"})) == {"co2": "428–438 ppm (optimal)"}
+
+
+def test_parse_chunk_text_projection(tmp_path: Path):
+    assert project.parse_chunk_text(SAMPLE, frozenset({"co2"})) == {"co2": "428–438 ppm (optimal)"}
+    assert project.parse_chunk_text(SAMPLE, frozenset({"raw"})) == {"raw": SAMPLE.strip()}
+    assert project.normalize_fields(["CO₂", "co2", "Humidity"]) == ["co2", "humidity"]
+    assert project.normalize_fields([]) is None
+
+    _make_file(tmp_path, "chunk_2025-08-11_01.txt", SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+    cache = project.ParseCache()
+    res = project.query_day(idx, "2025-08-11", fields=["humidity", "CO2"], cache=cache)
+    assert list(res[1]) == ["humidity", "co2"]
+    raw = project.query_day(idx, "2025-08-11", cache=cache)
+    assert raw[1] == {"raw": SAMPLE.strip()}
+    # one cached entry per projection; invalidating the path drops both
+    assert len(cache) == 2
+    cache.invalidate(str(tmp_path / "chunk_2025-08-11_01.txt"))
+    assert len(cache) == 0 and cache.bytes == 0
+
+
+def test_query_range(tmp_path: Path):
+    for name in ["chunk_2025-08-31_23.txt", "chunk_2025-09-01_00.txt", "chunk_2025-09-02_05.txt"]:
+        _make_file(tmp_path, name, SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+
+    rows = list(project.query_range(idx, "20250831", "2025-09-02", fields=["co2"], workers=4))
+    assert [(d, h) for d, h, _ in rows] == [("2025-08-31", 23), ("2025-09-01", 0), ("2025-09-02", 5)]
+    assert all(row == {"co2": "428–438 ppm (optimal)"} for _, _, row in rows)
+
+    rows = list(project.query_range(idx, "2025-09-01", "2025-09-02", hours=[0], workers=1))
+    assert rows[0][2] == {"raw": SAMPLE.strip()}
+    assert rows[1] == ("2025-09-02", 0, {"error": "file not found"})
+
+    assert project.parse_date_range_string("20250601..2025-09-30")[1].isoformat() == "2025-09-30"
+
+
+def test_bulk_extract(tmp_path: Path):
+    for d in (10, 11):
+        for h in (0, 7):
+            _make_file(tmp_path, f"chunk_2025-08-{d}_{h:02d}.txt", SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+
+    rows = list(project.bulk_extract(idx, fields=["CO2", "PM 2.5"], processes=2, batch_size=3))
+    assert [(d, h) for d, h, _ in rows] == [
+        ("2025-08-10", 0), ("2025-08-10", 7), ("2025-08-11", 0), ("2025-08-11", 7),
+    ]
+    assert rows[0][2] == {"co2": "428–438 ppm (optimal)", "pm25": "4.7 µg/m³ (good)"}
+    inline = list(project.bulk_extract(idx, processes=1))
+    assert inline[-1][2] == {"raw": SAMPLE.strip()}
+
+
+def test_parse_measurement():
+    assert project.parse_measurement("median 27.4°C, max 27.5°C, min 27.3°C") == {
+        "value": 27.4, "max": 27.5, "min": 27.3,
+    }
+    assert project.parse_measurement("428–438 ppm (optimal)") == {
+        "min": 428.0, "max": 438.0, "value": 433.0, "label": "optimal",
+    }
+    assert project.parse_measurement("63 (poor)") == {"value": 63.0, "label": "poor"}
+    assert project.parse_measurement("n.d.") == {}
+
+
+def test_build_column_store(tmp_path: Path):
+    _make_file(tmp_path, "chunk_2025-08-10_01.txt", SAMPLE)
+    _make_file(tmp_path, "chunk_2025-08-11_02.txt", SAMPLE.replace("(poor)", "(good)"))
+    idx = project.index_chunks(str(tmp_path))
+
+    store = project.build_column_store(idx, fields=["co2", "ieq"], processes=1)
+    assert store.hours == 48 and store.fields == ("co2", "ieq")
+    i = store.offset("2025-08-11", 2)
+    assert i == 26 and store.at(i) == ("2025-08-11", 2)
+    assert store.column("co2.value")[1] == 433.0
+    assert store.column("co2.max")[26] == 438.0
+    assert math.isnan(store.column("co2.value")[0])
+    codes = store.column("ieq.label")
+    assert [store.labels["ieq"][codes[j]] for j in (1, 26)] == ["poor", "good"]
+    assert codes[0] == -1
+
+
+def test_pack_archive_and_mapped_reads(tmp_path: Path):
+    data = tmp_path / "data"
+    data.mkdir()
+    _make_file(data, "chunk_2025-08-10_01.txt", SAMPLE)
+    _make_file(data, "chunk_2025-08-11_05.txt", SAMPLE.replace("CO₂: 428–438", "CO₂: 900–910"))
+    idx = project.index_chunks(str(data))
+    out = str(tmp_path / "archive.bin")
+    assert project.pack_archive(idx, out, workers=2) == 2
+
+    with project.MappedArchive(out) as arc:
+        for d in ("2025-08-10", "2025-08-11"):
+            assert arc.query_day(d, ["co2", "Temperature"]) == project.query_day(idx, d, ["co2", "Temperature"])
+            assert arc.query_day(d) == project.query_day(idx, d)
+        assert arc.query_hours("2025-08-11", [5, 6], ["co2"]) == project.query_hours(idx, "2025-08-11", [5, 6], ["co2"])
+        co2 = arc.numeric("co2")
+        assert len(co2) == 48 and co2[1] == 433.0 and co2[29] == 905.0
+        assert math.isnan(co2[0])
+        del co2
+
+
+def test_aggregate(tmp_path: Path):
+    # 2025-08-03 is a Sunday, 2025-08-04 a Monday
+    for day, h, low in [(3, 0, 400), (3, 1, 600), (4, 0, 800)]:
+        body = SAMPLE.replace("428–438", f"{low}–{low}")
+        _make_file(tmp_path, f"chunk_2025-08-{day:02d}_{h:02d}.txt", body)
+    store = project.build_column_store(project.index_chunks(str(tmp_path)), processes=1)
+
+    daily = project.aggregate(store, "CO2", "day", ("count", "mean", "max", "p50"))
+    assert daily == [
+        ("2025-08-03", {"count": 2.0, "mean": 500.0, "max": 600.0, "p50": 500.0}),
+        ("2025-08-04", {"count": 1.0, "mean": 800.0, "max": 800.0, "p50": 800.0}),
+    ]
+    weekly = project.aggregate(store, "co2", "week", ("count", "p95"))
+    assert [label for label, _ in weekly] == ["2025-W31", "2025-W32"]
+    assert weekly[0][1]["p95"] == 590.0
+    monthly = project.aggregate(store, "co2", "month", ("count", "min"), start="2025-08-04")
+    assert monthly == [("2025-08", {"count": 1.0, "min": 800.0})]
+
+
+def _bump_mtime(path: Path) -> None:
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+
+def test_chunk_watcher(tmp_path: Path):
+    _make_file(tmp_path, "chunk_2025-08-10_00.txt", SAMPLE)
+    for use_inotify in (True, False):
+        idx = project.index_chunks(str(tmp_path))
+        cache = project.ParseCache()
+        watcher = project.ChunkWatcher(idx, str(tmp_path), cache, use_inotify=use_inotify)
+        project.query_day(idx, "2025-08-10", cache=cache)
+        assert watcher.poll() == 0
+
+        _make_file(tmp_path, "chunk_2025-08-10_01.txt", SAMPLE)
+        _make_file(tmp_path, "notes.txt", "ignored")
+        _bump_mtime(tmp_path)
+        assert watcher.poll() == 1
+        assert sorted(idx.by_date["2025-08-10"]) == [0, 1]
+
+        (tmp_path / "chunk_2025-08-10_00.txt").unlink()
+        _bump_mtime(tmp_path)
+        assert watcher.poll() == 1
+        assert sorted(idx.by_date["2025-08-10"]) == [1]
+        assert len(cache) == 0
+        watcher.close()
+        # restore for the next mode
+        (tmp_path / "chunk_2025-08-10_01.txt").unlink()
+        (tmp_path / "notes.txt").unlink()
+        _make_file(tmp_path, "chunk_2025-08-10_00.txt", SAMPLE)
+
+
+def test_mask_index(tmp_path: Path):
+    for n in ["chunk_2025-08-10_00.txt", "chunk_2025-08-10_01.txt", "chunk_2025-08-12_23.txt"]:
+        _make_file(tmp_path, n, SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+    masks = project.MaskIndex.scan(str(tmp_path))
+
+    assert masks.day_count == idx.day_count == 2
+    assert masks.date_range() == idx.date_range() == ("2025-08-10 00:00", "2025-08-12 23:59")
+    assert masks.missing_hours("2025-08-10") == idx.missing_hours("2025-08-10")
+    assert masks.hour_paths("2025-08-12") == idx.by_date["2025-08-12"]
+    assert masks.coverage() == (3, 72)
+    assert masks.coverage("2025-08-11", "2025-08-11") == (0, 24)
+    assert masks.dates("2025-08-11") == ["2025-08-12"]
+    assert project.inspection_report(masks) == project.inspection_report(idx)
+    assert project.query_day(masks, "2025-08-10", ["co2"]) == project.query_day(idx, "2025-08-10", ["co2"])
+
+    masks.add("2025-08-11", 5)
+    assert masks.incomplete_days("2025-08-11", "2025-08-11") == [("2025-08-11", project.FULL_DAY_MASK & ~(1 << 5))]
+    assert masks.remove("2025-08-11", 5).endswith("chunk_2025-08-11_05.txt")
+    assert masks.day_count == 2
+    assert masks.to_chunk_index().by_date == idx.by_date
+    assert project.MaskIndex.from_chunk_index(idx, str(tmp_path)).to_chunk_index().by_date == idx.by_date
+    idx.add("2025-08-13", 0, str(tmp_path / "chunk_2025-08-13_00.txt.gz"))
+    with pytest.raises(ValueError):
+        project.MaskIndex.from_chunk_index(idx, str(tmp_path))
+
+
+def test_index_sites(tmp_path: Path):
+    mount_a, mount_b = tmp_path / "a", tmp_path / "b"
+    for base, site, rel, name in [
+        (mount_a, "north", "2025/08", "chunk_2025-08-10_00.txt"),
+        (mount_a, "south", "2025/08", "chunk_2025-08-10_01.txt"),
+        (mount_b, "north", "2025/09", "chunk_2025-09-01_02.txt"),
+    ]:
+        d = base / site / rel
+        d.mkdir(parents=True)
+        _make_file(d, name, SAMPLE)
+
+    sites = project.index_sites([str(mount_a), str(mount_b)], workers=4)
+    assert sorted(sites) == ["north", "south"]
+    assert sites["north"].dates() == ["2025-08-10", "2025-09-01"]
+
+    res = project.query_sites_day(sites, "2025-08-10", ["co2"])
+    assert list(res) == ["north", "south"]
+    assert list(res["north"]) == [0] and list(res["south"]) == [1]
+    res = project.query_sites_hours(sites, "2025-08-10", [1], site="south")
+    assert list(res) == ["south"] and "raw" in res["south"][1]
+
+    flat = project.index_sites({"lab": str(mount_a / "south")})
+    assert list(flat) == ["lab"]
+
+
+def test_compressed_chunks(tmp_path: Path):
+    import gzip
+    import tarfile
+    import zipfile
+
+    with gzip.open(tmp_path / "chunk_2025-07-01_00.txt.gz", "wt", encoding="utf-8") as f:
+        f.write(SAMPLE)
+    with zipfile.ZipFile(tmp_path / "chunks_2025-06.zip", "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("2025-06/chunk_2025-06-01_05.txt", SAMPLE.replace("428–438", "500–510"))
+        z.writestr("chunk_2025-07-01_00.txt", "shadowed by the .gz file")
+    member = tmp_path / "chunk_2025-05-01_23.txt"
+    member.write_text(SAMPLE, encoding="utf-8")
+    with tarfile.open(tmp_path / "chunks_2025-05.tar.gz", "w:gz") as t:
+        t.add(member, arcname="chunk_2025-05-01_23.txt")
+    member.unlink()
+
+    idx = project.index_chunks(str(tmp_path))
+    assert idx.dates() == ["2025-05-01", "2025-06-01", "2025-07-01"]
+    assert idx.by_date["2025-07-01"][0].endswith(".txt.gz")
+    assert project.MEMBER_SEP in idx.by_date["2025-06-01"][5]
+    cache = project.ParseCache()
+    assert project.query_day(idx, "2025-06-01", ["co2"], cache)[5] == {"co2": "500–510 ppm (optimal)"}
+    assert project.query_day(idx, "2025-05-01", ["co2"], cache)[23]["co2"].startswith("428")
+    assert project.query_day(idx, "2025-07-01")[0] == {"raw": SAMPLE.strip()}
+
+    # the sidecar keeps non-template paths
+    cached = project.index_chunks_cached(str(tmp_path))
+    assert project.index_chunks_cached(str(tmp_path)).by_date == cached.by_date == idx.by_date
+
+    # a bundle rewritten in place (folder mtime unchanged) invalidates the sidecar
+    folder_mtime = os.stat(tmp_path).st_mtime_ns
+    with tarfile.open(tmp_path / "chunks_2025-05.tar.gz", "w:gz") as t:
+        for h in (22, 23):
+            member.write_text(SAMPLE, encoding="utf-8")
+            t.add(member, arcname=f"chunk_2025-05-01_{h}.txt")
+    member.unlink()
+    os.utime(tmp_path, ns=(folder_mtime, folder_mtime))
+    assert sorted(project.index_chunks_cached(str(tmp_path)).by_date["2025-05-01"]) == [22, 23]
+    assert project.query_day(idx, "2025-05-01", ["co2"], cache)[23]["co2"].startswith("428")
+    # a handle closed under a reader (eviction) is reopened, not read
+    project._bundle(str(tmp_path / "chunks_2025-06.zip")).close()
+    assert project.read_file(idx.by_date["2025-06-01"][5]).startswith("Data:")
+
+    # archiving a plain file into a bundle keeps the hour indexed
+    watcher = project.ChunkWatcher(idx, str(tmp_path), cache, use_inotify=False)
+    (tmp_path / "chunk_2025-07-01_00.txt.gz").unlink()
+    _bump_mtime(tmp_path)
+    assert watcher.poll() == 1
+    assert idx.by_date["2025-07-01"][0].endswith("chunks_2025-06.zip::chunk_2025-07-01_00.txt")
+
+
+def test_query_service(tmp_path: Path):
+    import asyncio
+    import json
+
+    _make_file(tmp_path, "chunk_2025-08-11_01.txt", SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+    service = project.QueryService(idx, str(tmp_path), workers=2)
+
+    assert service.handle("/day", {"date": "20250811", "fields": "co2"}) == (
+        200, {"date": "2025-08-11", "hours": {"01": {"co2": "428–438 ppm (optimal)"}}},
+    )
+    status, payload = service.handle("/hours", {"date": "2025-08-11", "hours": "1,2"})
+    assert status == 200 and payload["hours"]["02"] == {"error": "file not found"}
+    status, payload = service.handle("/range", {"from": "2025-08-10", "to": "2025-08-11", "fields": "pm2.5"})
+    assert payload["rows"] == [{"pm25": "4.7 µg/m³ (good)", "date": "2025-08-11", "hour": 1}]
+    assert service.handle("/day", {"date": "nope"})[0] == 400
+    assert service.handle("/nope", {})[0] == 404
+
+    async def two_requests_one_connection() -> list:
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        bodies = []
+        for target in ("/inspect", "/stats"):
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+            await writer.drain()
+            assert (await reader.readline()).startswith(b"HTTP/1.1 200")
+            headers = {}
+            while (line := await reader.readline()) != b"\r\n":
+                k, _, v = line.decode().partition(":")
+                headers[k.lower()] = v.strip()
+            assert headers["connection"] == "keep-alive"
+            bodies.append(json.loads(await reader.readexactly(int(headers["content-length"]))))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return bodies
+
+    inspect, stats = asyncio.run(two_requests_one_connection())
+    assert inspect["days_covered"] == 1 and inspect["missing_hours"]["2025-08-11"][0] == 0
+    assert stats["cache"]["misses"] >= 1
+
+    # a corrupt chunk is a server error, not a bad request
+    (tmp_path / "chunk_2025-08-12_00.txt").write_bytes(b"Data: \xff\xfe")
+    idx.add("2025-08-12", 0, str(tmp_path / "chunk_2025-08-12_00.txt"))
+    assert service.handle("/day", {"date": "2025-08-12"})[0] == 500
+
+    async def status_of(request: bytes) -> bytes:
+        server = await service.start("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        writer.write(request)
+        await writer.drain()
+        line = await reader.readline()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return line
+
+    assert asyncio.run(status_of(b"GET /stats HTTP/1.1\r\nContent-Length: x\r\n\r\n")).startswith(b"HTTP/1.1 400")
+    service.handle = lambda path, params: 1 / 0
+    assert asyncio.run(status_of(b"GET /stats HTTP/1.1\r\n\r\n")).startswith(b"HTTP/1.1 500")
+    service.close()
+
+
+def test_batch_cli(tmp_path: Path, capsys, monkeypatch):
+    import io
+    import json
+
+    _make_file(tmp_path, "chunk_2025-08-11_01.txt", SAMPLE)
+    _make_file(tmp_path, "chunk_2025-08-12_01.txt", SAMPLE)
+
+    assert project.run_cli(["query", "--folder", str(tmp_path), "--from", "2025-08-11",
+                            "--to", "2025-08-12", "--fields", "co2"]) == 0
+    lines = [json.loads(x) for x in capsys.readouterr().out.splitlines()]
+    assert lines == [
+        {"date": "2025-08-11", "hour": 1, "co2": "428–438 ppm (optimal)"},
+        {"date": "2025-08-12", "hour": 1, "co2": "428–438 ppm (optimal)"},
+    ]
+
+    queries = "--date 2025-08-11 --hours 1,2 --fields pm25\n# comment\n--date nope\n"
+    monkeypatch.setattr("sys.stdin", io.StringIO(queries))
+    assert project.run_cli(["batch", "--folder", str(tmp_path), "--format", "csv"]) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        "query,date,hour,field,value",
+        "1,2025-08-11,01,pm25,4.7 µg/m³ (good)",
+        "1,2025-08-11,02,error,file not found",
+        "3,,,error,time data 'nope' does not match format '%Y-%m-%d'",
+    ]
+
+
+def test_streaming_output_writers(tmp_path: Path):
+    import io
+
+    class Sink(io.StringIO):
+        flushes = 0
+
+        def flush(self):
+            self.flushes += 1
+            super().flush()
+
+    _make_file(tmp_path, "chunk_2025-08-11_01.txt", SAMPLE)
+    _make_file(tmp_path, "chunk_2025-08-11_02.txt", SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+    for fields in (None, ["co2"]):
+        day = project.query_day(idx, "2025-08-11", fields)
+        lines = list(project.iter_query_output_day(day, fields))
+        assert "\n".join(lines) == project.format_query_output_day(day, fields)
+        hours = project.query_hours(idx, "2025-08-11", [2, 5], fields)
+        sink = Sink()
+        n = project.write_output(project.iter_query_output_hours(hours, fields), sink, flush_every=2)
+        assert sink.getvalue() == project.format_query_output_hours(hours, fields) + "\n"
+        assert sink.flushes == n // 2 + 1
+
+    rows = project.query_range(idx, "2025-08-11", "2025-08-11", fields=["co2"])
+    assert list(project.iter_query_output_range(rows, ["co2"]))[:3] == [
+        "[2025-08-11 01:00]", "  co2: 428–438 ppm (optimal)", "",
+    ]
+
+
+def test_instrumentation(tmp_path: Path):
+    _make_file(tmp_path, "chunk_2025-08-11_01.txt", SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+    original = project.read_file
+    project.enable_instrumentation()
+    try:
+        project.STATS.reset()
+        project.query_day(idx, "2025-08-11", ["co2"])
+        rows = list(project.query_range(idx, "2025-08-11", "2025-08-11", workers=1))
+        stats = project.STATS.stages
+        assert stats["query_day"].calls == 1 and stats["query_range"].calls == 1
+        assert stats["read_file"].calls == 2
+        assert stats["read_file"].bytes == 2 * len(SAMPLE.encode("utf-8"))
+        assert "parse_chunk_text" in project.STATS.summary()
+        assert rows[0][2] == {"raw": SAMPLE.strip()}
+    finally:
+        project.disable_instrumentation()
+    assert project.read_file is original
+
+    out = tmp_path / "q.pstats"
+    assert project.profile_call(str(out), project.query_day, idx, "2025-08-11") == project.query_day(idx, "2025-08-11")
+    assert out.stat().st_size > 0
+
+
+def test_analyze_gaps(tmp_path: Path):
+    # 08-10 22:00 present, then nothing until 08-13 02:00: one outage spanning two full days
+    for n in ["chunk_2025-08-10_21.txt", "chunk_2025-08-10_22.txt", "chunk_2025-08-13_02.txt",
+              "chunk_2025-08-13_04.txt"]:
+        _make_file(tmp_path, n, SAMPLE)
+    idx = project.index_chunks(str(tmp_path))
+
+    report = project.analyze_gaps(idx)
+    assert project.format_hour_offset(report.start) == "2025-08-10 21:00"
+    assert report.total == 56 and report.present == 4
+    assert [(project.format_hour_offset(o), n) for o, n in report.outages] == [
+        ("2025-08-10 23:00", 51), ("2025-08-13 03:00", 1),
+    ]
+    assert report.missing_days == 2
+    assert report.longest(1) == [report.outages[0]]
+    assert project.analyze_gaps(project.MaskIndex.scan(str(tmp_path))).outages == report.outages
+
+    full = project.analyze_gaps(idx, "2025-08-10", "2025-08-13")
+    assert full.total == 96 and full.outages[0] == (full.start, 21)
+    assert "fully missing days: 2" in project.inspection_report(idx)
+
+
+def test_export_columnar_incremental(tmp_path: Path):
+    import csv
+
+    data = tmp_path / "data"
+    data.mkdir()
+    _make_file(data, "chunk_2025-07-31_23.txt", SAMPLE)
+    _make_file(data, "chunk_2025-08-01_00.txt", SAMPLE.replace("PM2.5: 4.7", "PM2.5: 9.1"))
+    out = tmp_path / "export"
+
+    first = project.export_columnar(project.index_chunks(str(data)), str(out), ["co2", "pm25"], fmt="csv")
+    assert first["written"] == ["2025-07", "2025-08"] and first["rows"] == 2
+    with open(out / "month=2025-08" / "part-0.csv", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert rows == [{
+        "date": "2025-08-01", "hour": "0",
+        "co2_value": "433.0", "co2_min": "428.0", "co2_max": "438.0", "co2_label": "optimal",
+        "pm25_value": "9.1", "pm25_min": "", "pm25_max": "", "pm25_label": "good",
+    }]
+
+    again = project.export_columnar(project.index_chunks(str(data)), str(out), ["co2", "pm25"], fmt="csv")
+    assert again["written"] == [] and again["unchanged"] == ["2025-07", "2025-08"]
+
+    _make_file(data, "chunk_2025-08-01_01.txt", SAMPLE)
+    (data / "chunk_2025-07-31_23.txt").unlink()
+    third = project.export_columnar(project.index_chunks(str(data)), str(out), ["co2", "pm25"], fmt="csv")
+    assert third["written"] == ["2025-08"] and third["removed"] == ["2025-07"]
+    assert not (out / "month=2025-07").exists()
+
+    # a removed month is also cleaned up when the column set changes
+    _make_file(data, "chunk_2025-06-30_00.txt", SAMPLE)
+    project.export_columnar(project.index_chunks(str(data)), str(out), ["co2"], fmt="csv")
+    (data / "chunk_2025-06-30_00.txt").unlink()
+    fourth = project.export_columnar(project.index_chunks(str(data)), str(out), ["co2", "humidity"], fmt="csv")
+    assert fourth["written"] == ["2025-08"] and fourth["removed"] == ["2025-06"]
+    assert sorted(p.name for p in out.iterdir() if p.is_dir()) == ["month=2025-08"]
+
+
+def test_sqlite_store_matches_query_day(tmp_path: Path):
+    data = tmp_path / "data"
+    data.mkdir()
+    _make_file(data, "chunk_2025-08-01_00.txt", SAMPLE)
+    humid = SAMPLE.replace("CO₂: 428–438 ppm", "CO₂: 1200–1300 ppm").replace("median 49.8%", "median 65.0%")
+    _make_file(data, "chunk_2025-08-01_05.txt", humid)
+    idx = project.index_chunks(str(data))
+
+    with project.SqliteStore(str(tmp_path / "s.db")) as store:
+        assert store.ingest(idx, "lab") == {"ingested": 2, "unchanged": 0, "removed": 0}
+        for fields in (None, ["Temperature", "CO2"]):
+            assert store.query_day("2025-08-01", fields) == project.query_day(idx, "2025-08-01", fields)
+        assert store.query_hours("2025-08-01", [5, 7], ["pm25"]) == project.query_hours(idx, "2025-08-01", [5, 7], ["pm25"])
+
+        hits = store.where("co2 > 1000, humidity>60%")
+        assert [(s, d, h) for s, d, h, _ in hits] == [("lab", "2025-08-01", 5)]
+        assert hits[0][3] == {"co2": "1200–1300 ppm (optimal)", "humidity": "median 65.0%"}
+        with pytest.raises(ValueError):
+            store.where("co2 > 1000; DROP TABLE chunks")
+
+        # projections: unknown or hostile names are dropped, like query_day does
+        for fields in (["foo"], ["path"], ["(select group_concat(name) from sqlite_master)"], ["co2", "mtime_ns"]):
+            assert store.query_day("2025-08-01", fields) == project.query_day(idx, "2025-08-01", fields)
+        assert store.where("co2 > 1000", fields=["size", "pm25"])[0][3] == {"pm25": "4.7 µg/m³ (good)"}
+
+        (data / "chunk_2025-08-01_00.txt").unlink()
+        assert store.ingest(project.index_chunks(str(data)), "lab") == {"ingested": 0, "unchanged": 1, "removed": 1}
+        assert list(store.query_day("2025-08-01")) == [5]
+
+
+def test_alert_engine_duration_rate_and_watermark(tmp_path: Path):
+    data = tmp_path / "data"
+    data.mkdir()
+    pm = {0: 40, 1: 50, 2: 38, 3: 10, 4: 36, 5: 37, 7: 90}  # hour 6 missing
+    for h, v in pm.items():
+        _make_file(data, f"chunk_2025-08-01_{h:02d}.txt", SAMPLE.replace("PM2.5: 4.7", f"PM2.5: {v}"))
+    engine = project.AlertEngine(["pm25 > 35 µg/m³ for 3h", "pm25 delta >= 12", "pm25 > 35 for 2h"])
+
+    alerts = engine.run(project.index_chunks(str(data)))
+    got = [(a.rule, project.format_hour_offset(a.start)[-5:], project.format_hour_offset(a.fired)[-5:]) for a in alerts]
+    assert got == [
+        ("pm25 > 35 for 2h", "00:00", "01:00"),
+        ("pm25 > 35 µg/m³ for 3h", "00:00", "02:00"),
+        ("pm25 delta >= 12", "04:00", "04:00"),
+        ("pm25 > 35 for 2h", "04:00", "05:00"),
+    ]  # 40->50 is only +10; hour 7 follows a gap, so neither its delta nor a run counts
+
+    state = tmp_path / "alerts.json"
+    engine.save(str(state))
+    for h, v in {8: 95, 9: 99}.items():
+        _make_file(data, f"chunk_2025-08-01_{h:02d}.txt", SAMPLE.replace("PM2.5: 4.7", f"PM2.5: {v}"))
+    resumed = project.AlertEngine.load(str(state), [r.text for r in engine.rules])
+    alerts = resumed.run(project.index_chunks(str(data)))
+    assert [(a.rule, a.fired % 24) for a in alerts] == [
+        ("pm25 > 35 for 2h", 8),
+        ("pm25 > 35 µg/m³ for 3h", 9),
+    ]
+
+
+def test_rollups_incremental_and_tiers(tmp_path: Path):
+    data = tmp_path / "data"
+    data.mkdir()
+    co2 = {}
+    for day in ("2025-07-31", "2025-08-01", "2025-08-02"):
+        for h in range(24):
+            v = 400 + 2 * h + (50 if day == "2025-08-02" else 0)
+            co2[(day, h)] = v
+            _make_file(data, f"chunk_{day}_{h:02d}.txt", SAMPLE.replace("428–438", f"{v - 5}–{v + 5}"))
+    idx = project.index_chunks(str(data))
+    side = tmp_path / "rollups.json"
+
+    rollups = project.build_rollups(idx, str(data), str(side), ["co2", "pm25"])
+    assert sorted(rollups.days) == ["2025-07-31", "2025-08-01", "2025-08-02"]
+    assert sorted(rollups.months) == ["2025-07", "2025-08"]
+    rows = dict(rollups.aggregate("CO2", "month", ("count", "mean", "min", "max", "p50")))
+    aug = sorted(v for (d, _), v in co2.items() if d.startswith("2025-08"))
+    assert rows["2025-08"] == {"count": 48.0, "mean": sum(aug) / 48, "min": 400.0, "max": 496.0,
+                               "p50": project._percentile(aug, 50)}
+    day = dict(rollups.aggregate("co2", "day", ("count", "max"), "2025-08-02", "2025-08-02"))
+    assert day == {"2025-08-02": {"count": 24.0, "max": 496.0}}
+
+    # unchanged files: nothing re-parsed; one rewritten hour: only its day
+    again = project.load_rollups(str(side), ["co2", "pm25"])
+    assert again.update(idx) == {"days": 0, "removed": 0, "months": 0}
+    _bump_mtime(str(data / "chunk_2025-08-01_05.txt"))
+    (data / "chunk_2025-07-31_00.txt").unlink()
+    for h in range(1, 24):
+        (data / f"chunk_2025-07-31_{h:02d}.txt").unlink()
+    idx = project.index_chunks(str(data))
+    assert again.update(idx) == {"days": 1, "removed": 1, "months": 2}
+    assert sorted(again.months) == ["2025-08"]
+    assert again.summary("co2", "2025-07-01", "2025-08-31").count == 48
+
+
+def test_rollup_cli_exact_and_estimate_note(tmp_path: Path, capsys):
+    for h in range(3):
+        _make_file(tmp_path, f"chunk_2025-08-01_{h:02d}.txt", SAMPLE)
+    assert project.run_cli(["rollup", "--folder", str(tmp_path), "--field", "co2", "--stats", "count,p95"]) == 0
+    approx = capsys.readouterr().out
+    assert "estimates" in approx
+    assert project.run_cli(["rollup", "--folder", str(tmp_path), "--field", "co2", "--stats", "count,p95", "--exact"]) == 0
+    exact = capsys.readouterr().out
+    assert "estimates" not in exact and exact.splitlines()[1] == approx.splitlines()[1]
+    assert not project.STATS.enabled  # rollup --stats is not the global instrumentation flag
+
+    parser = project.build_arg_parser()
+    assert parser.parse_args(["--stats", "rollup", "--field", "co2"]).stats is True
+    assert parser.parse_args(["rollup", "--field", "co2", "--stats", "p95"]).stats is False
+
+
+def test_quantile_sketch_merge_error():
+    import random
+
+    rng = random.Random(7)
+    values = [rng.lognormvariate(6, 0.4) for _ in range(50_000)]
+    parts = [project.QuantileSketch() for _ in range(5)]
+    for i, v in enumerate(values):
+        parts[i % 5].add(v)
+    merged = project.QuantileSketch()
+    for p in parts:
+        merged.merge(p)
+    assert merged.n == len(values) and sum(len(l) for l in merged.levels) < 1000
+    values.sort()
+    for q in (0.5, 0.95, 0.99):
+        est = merged.quantile(q)
+        rank = sum(1 for v in values if v <= est) / len(values)
+        assert abs(rank - q) < 0.02
+    small = project.QuantileSketch()
+    for v in (3.0, 1.0, 2.0, 4.0):
+        small.add(v)
+    assert small.quantile(0.5) == 2.5 and project.QuantileSketch.from_json(small.to_json()).quantile(0.5) == 2.5
+
+
+def test_range_quantiles_across_sites(tmp_path: Path):
+    values = {}
+    for site, offset in (("north", 0), ("south", 1000)):
+        (tmp_path / "sites" / site).mkdir(parents=True)
+        for day in ("2025-08-01", "2025-08-02"):
+            for h in range(24):
+                v = offset + h * 10 + (5 if day.endswith("02") else 0)
+                values[(site, day, h)] = v
+                _make_file(tmp_path / "sites" / site, f"chunk_{day}_{h:02d}.txt", SAMPLE.replace("428–438", f"{v}–{v}"))
+    sites = project.index_sites(str(tmp_path / "sites"))
+    rollups = project.site_rollups(sites, str(tmp_path / "rollups"), ["co2"])
+    assert sorted(os.listdir(tmp_path / "rollups")) == ["north.rollups.json", "south.rollups.json"]
+
+    both = sorted(values.values())
+    got = project.range_quantiles(rollups, "CO2", "2025-08-01", "2025-08-02", qs=(50, 99))
+    assert got["count"] == 96 and got["rank_error"] == 0.0
+    assert got["p50"] == project._percentile(both, 50) and got["p99"] == project._percentile(both, 99)
+
+    north = sorted(v for (s, d, _), v in values.items() if s == "north" and d == "2025-08-02")
+    got = project.range_quantiles(rollups, "co2", "2025-08-02", "2025-08-02", qs=(95,), site="north")
+    assert got["count"] == 24 and got["p95"] == project._percentile(north, 95)
+
+
+def test_search_index_incremental(tmp_path: Path):
+    good = SAMPLE.replace("IEQ median: 63 (poor)", "IEQ median: 80 (optimal)")
+    _make_file(tmp_path, "chunk_2025-08-01_00.txt", SAMPLE)
+    _make_file(tmp_path, "chunk_2025-08-01_01.txt", good)
+    _make_file(tmp_path, "chunk_2025-08-02_05.txt", SAMPLE + "\nNote: filter replaced\n")
+    side = str(tmp_path / "search.json")
+
+    sidx = project.build_search_index(project.index_chunks(str(tmp_path)), str(tmp_path), side)
+    assert sidx.search("IEQ:poor") == [("2025-08-01", 0), ("2025-08-02", 5)]
+    assert sidx.search("ieq:poor filter") == [("2025-08-02", 5)]
+    assert sidx.search("optimal") == [("2025-08-01", 0), ("2025-08-01", 1), ("2025-08-02", 5)]  # CO₂ label too
+    assert sidx.search("PM2.5:good", "2025-08-02", "2025-08-02") == [("2025-08-02", 5)]
+    assert sidx.search("nonexistent") == []
+
+    # a newer hour is appended; a rewritten hour moves between postings
+    _make_file(tmp_path, "chunk_2025-08-03_00.txt", SAMPLE)
+    again = project.build_search_index(project.index_chunks(str(tmp_path)), str(tmp_path), side)
+    assert again.search("ieq:poor")[-1] == ("2025-08-03", 0)
+    _make_file(tmp_path, "chunk_2025-08-01_00.txt", good)
+    _bump_mtime(tmp_path / "chunk_2025-08-01_00.txt")
+    again = project.build_search_index(project.index_chunks(str(tmp_path)), str(tmp_path), side)
+    assert again.search("ieq:poor") == [("2025-08-02", 5), ("2025-08-03", 0)]
+
+    # a deleted hour on the newest day must not survive an append-looking update
+    (tmp_path / "chunk_2025-08-03_00.txt").unlink()
+    _make_file(tmp_path, "chunk_2025-08-03_05.txt", good)
+    again = project.build_search_index(project.index_chunks(str(tmp_path)), str(tmp_path), side)
+    assert again.search("ieq:poor") == [("2025-08-02", 5)]
+    assert again.search("ieq:optimal")[-1] == ("2025-08-03", 5)
+
+    offsets = [5, 6, 300, 100_000]
+    assert project.decode_postings(project.encode_postings(offsets)) == offsets
+
+
+def test_quantiles_endpoint_refreshes_only_on_changes(tmp_path: Path, monkeypatch):
+    for h in range(4):
+        _make_file(tmp_path, f"chunk_2025-08-01_{h:02d}.txt", SAMPLE)
+    service = project.QueryService(project.index_chunks(str(tmp_path)), str(tmp_path), workers=1)
+    service.watcher.close()
+    service.watcher = project.ChunkWatcher(service.idx, str(tmp_path), service.cache, use_inotify=False)
+    assert service.handle("/quantiles", {"field": "co2"})[1]["count"] == 4
+
+    calls = []
+    real = project._chunks_fingerprint
+    monkeypatch.setattr(project, "_chunks_fingerprint", lambda *a: calls.append(a) or real(*a))
+    assert service.handle("/quantiles", {"field": "co2", "q": "50"})[1]["count"] == 4
+    assert calls == []  # warm: no stat pass over the archive
+
+    _make_file(tmp_path, "chunk_2025-08-02_00.txt", SAMPLE)
+    _bump_mtime(tmp_path)
+    assert service.handle("/quantiles", {"field": "co2"})[1]["count"] == 5
+    service.close()
+
+
+def test_gz_members_and_chunk_precedence(tmp_path: Path):
+    import gzip
+    import zipfile
+
+    with zipfile.ZipFile(tmp_path / "chunks_2025-06.zip", "w") as z:
+        z.writestr("chunk_2025-06-01_00.txt.gz", gzip.compress(SAMPLE.encode("utf-8")))
+        z.writestr("chunk_2025-06-01_01.txt", "member")
+    _make_file(tmp_path, "chunk_2025-06-01_01.txt", SAMPLE.replace("428–438", "600–610"))
+    with gzip.open(tmp_path / "chunk_2025-06-01_01.txt.gz", "wt", encoding="utf-8") as f:
+        f.write("mid-compression copy")
+
+    idx = project.index_chunks(str(tmp_path))
+    assert project.query_day(idx, "2025-06-01", ["co2"])[0] == {"co2": "428–438 ppm (optimal)"}
+    assert idx.by_date["2025-06-01"][1] == str(tmp_path / "chunk_2025-06-01_01.txt")
+    assert project.index_sites({"s": str(tmp_path)})["s"].by_date == idx.by_date
+
+    # the watcher agrees: a .gz landing doesn't shadow the .txt, and removing the .txt falls back to it
+    watcher = project.ChunkWatcher(idx, str(tmp_path), use_inotify=False)
+    (tmp_path / "chunk_2025-06-01_01.txt").unlink()
+    _bump_mtime(tmp_path)
+    assert watcher.poll() == 1
+    assert idx.by_date["2025-06-01"][1] == str(tmp_path / "chunk_2025-06-01_01.txt.gz")